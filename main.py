@@ -3,8 +3,15 @@
 # Trusted Resource Concierge, Monetization lanes. Keeps Diet/Edu/Exercise/Share.
 
 import os, time, urllib.parse, uuid, json, datetime as dt
+import atexit, base64, csv, functools, hashlib, heapq, io, itertools, logging, math, mmap, queue, sys, tempfile, threading
+from collections import Counter, OrderedDict, defaultdict, deque
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import List, Dict, Any, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 
 # ---------------------------
@@ -27,11 +34,42 @@ MAPBOX_TOKEN        = secret_or_env("MAPBOX_TOKEN")
 CHECKOUT_URL        = secret_or_env("CHECKOUT_URL")  # optional, for Monetization tab
 
 # Optional: Supabase persistence
+SUPABASE_TIMEOUT_S = float(secret_or_env("SUPABASE_TIMEOUT_S") or 10)
+SUPABASE_RETRIES   = int(secret_or_env("SUPABASE_RETRIES") or 2)
+
+@st.cache_resource(show_spinner=False)  # runs before set_page_config; must not draw anything
+def get_supabase():
+    # Built once per process and shared by every session and the persist worker: the client's
+    # httpx pools keep connections alive across reruns. Failures aren't cached, so init is retried.
+    from supabase import create_client, ClientOptions
+    opts = ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT_S, storage_client_timeout=SUPABASE_TIMEOUT_S)
+    return create_client(SUPABASE_URL, SUPABASE_KEY, options=opts)
+
+def sb_transient(e: Exception) -> bool:
+    # Worth retrying: network/timeouts, HTTP 5xx/429 (postgrest reports the status as the code when the
+    # body isn't JSON), PostgREST's connection errors and Postgres connection/resource/serialization
+    # failures. Anything else (missing column, RLS, bad request) fails the same way every time.
+    import httpx
+    if isinstance(e, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    code = str(getattr(e, "code", "") or "")
+    return (code == "429" or (len(code) == 3 and code.startswith("5")) or code.startswith("PGRST00")
+            or code[:2] in ("08", "53") or code in ("40001", "40P01", "57P01"))
+
+def sb_execute(query, retries: int = SUPABASE_RETRIES, backoff: float = 0.3):
+    # Run a PostgREST query with exponential backoff on transient errors
+    for attempt in range(retries + 1):
+        try:
+            return query.execute()
+        except Exception as e:
+            if attempt >= retries or not sb_transient(e):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
 SUPABASE = None
 if SUPABASE_URL and SUPABASE_KEY:
     try:
-        from supabase import create_client
-        SUPABASE = create_client(SUPABASE_URL, SUPABASE_KEY)
+        SUPABASE = get_supabase()
     except Exception as e:
         st.sidebar.error(f"Supabase init failed: {e}")
 
@@ -76,6 +114,13 @@ T = {
     "underbudgets": "Great job staying under budget! +30 XP 🎉",
     "overbudgets": "Budgets exceeded — tomorrow is a fresh start!",
     "recipes": "Recommended recipes",
+    "sort_by": "Sort by",
+    "sort_relevance": "Best match",
+    "sort_sodium": "Sodium (low → high)",
+    "sort_minutes": "Time to cook",
+    "sort_cals": "Calories (low → high)",
+    "page": "Page",
+    "page_size": "Per page",
     "video": "▶️ Video",
     "add_meal": "Add to Meal Plan (+15 XP)",
     "cook_along": "Cook-Along (10-min)",
@@ -117,13 +162,14 @@ T = {
     "privacy": "Privacy: You control caregiver access & data sharing settings.",
     "claim": "Claim Weekly Challenge (+50 XP)",
     "summary": "Caregiver Summary (7 days):",
-    "avg_steps": "- Avg steps: 7,350",
-    "lessons_done": "- Lessons completed: 5",
-    "meals_logged": "- Healthy meals logged: 9",
+    "avg_steps": "- Avg steps: {:,}",
+    "lessons_done": "- Lessons completed: {}",
+    "meals_logged": "- Healthy meals logged: {}",
     "simple": "Simple UI (High Contrast / Large Type)",
     "lang": "Language",
     "culture": "Cultural Lens",
     "live_ctx": "Live Context",
+    "ctx_loading": "Still fetching weather and air quality…",
     "weather": "Weather",
     "aqi": "Air Quality",
     # Manage (Vitals/Meds)
@@ -139,6 +185,8 @@ T = {
     "add_med": "Add Medication",
     "taken": "Mark as Taken",
     "missed": "Missed",
+    "remove_med": "Remove",
+    "tz": "Reminder time zone",
     # N-of-1
     "n1_title": "Design your N-of-1 Experiment",
     "n1_desc": "Compare A vs B (e.g., late-night snacking vs none) and track your outcome (BP, sleep, energy).",
@@ -147,6 +195,8 @@ T = {
     "outcome": "Outcome to track (e.g., Morning BP, Energy 1–5)",
     "start": "Start date",
     "days_per_phase": "Days per phase",
+    "cycles": "Crossover cycles (A→B)",
+    "washout": "Washout days per phase",
     "add_obs": "Add Today’s Observation",
     "end_exp": "End Experiment & Analyze",
     # Community
@@ -158,6 +208,7 @@ T = {
     "event_desc": "Description",
     "event_add": "Add Event",
     "rsvp": "RSVP",
+    "radius": "Within",
     # Concierge
     "concierge": "Trusted Resource Concierge",
     "pick_cond": "Pick a condition",
@@ -201,6 +252,13 @@ T = {
     "underbudgets": "¡Excelente! Dentro del presupuesto. +30 XP 🎉",
     "overbudgets": "Presupuestos superados — ¡mañana es un nuevo comienzo!",
     "recipes": "Recetas recomendadas",
+    "sort_by": "Ordenar por",
+    "sort_relevance": "Mejor coincidencia",
+    "sort_sodium": "Sodio (menor → mayor)",
+    "sort_minutes": "Tiempo de cocina",
+    "sort_cals": "Calorías (menor → mayor)",
+    "page": "Página",
+    "page_size": "Por página",
     "video": "▶️ Video",
     "add_meal": "Añadir al plan (+15 XP)",
     "cook_along": "Cocinar juntos (10 min)",
@@ -242,13 +300,14 @@ T = {
     "privacy": "Privacidad: tú decides qué compartir.",
     "claim": "Canjear reto semanal (+50 XP)",
     "summary": "Resumen para cuidadores (7 días):",
-    "avg_steps": "- Pasos promedio: 7.350",
-    "lessons_done": "- Lecciones completadas: 5",
-    "meals_logged": "- Comidas saludables registradas: 9",
+    "avg_steps": "- Pasos promedio: {:,}",
+    "lessons_done": "- Lecciones completadas: {}",
+    "meals_logged": "- Comidas saludables registradas: {}",
     "simple": "Interfaz simple (alto contraste / letra grande)",
     "lang": "Idioma",
     "culture": "Lente cultural",
     "live_ctx": "Contexto en vivo",
+    "ctx_loading": "Aún cargando el clima y la calidad del aire…",
     "weather": "Clima",
     "aqi": "Calidad del aire",
     # Manage
@@ -264,6 +323,8 @@ T = {
     "add_med": "Añadir medicamento",
     "taken": "Tomado",
     "missed": "Olvidado",
+    "remove_med": "Quitar",
+    "tz": "Zona horaria de recordatorios",
     # N-of-1
     "n1_title": "Diseña tu experimento N-of-1",
     "n1_desc": "Compara A vs B y registra tu resultado (TA, sueño, energía).",
@@ -272,6 +333,8 @@ T = {
     "outcome": "Resultado a seguir",
     "start": "Fecha de inicio",
     "days_per_phase": "Días por fase",
+    "cycles": "Ciclos de cruce (A→B)",
+    "washout": "Días de lavado por fase",
     "add_obs": "Añadir observación de hoy",
     "end_exp": "Finalizar experimento y analizar",
     # Community
@@ -283,6 +346,7 @@ T = {
     "event_desc": "Descripción",
     "event_add": "Añadir evento",
     "rsvp": "Apuntarme",
+    "radius": "Radio",
     # Concierge
     "concierge": "Conserjería de recursos confiables",
     "pick_cond": "Elige una condición",
@@ -329,20 +393,104 @@ CULTURE_TAGS = {
     "global": []
 }
 
-RECIPES = [
-    {"id":"r1","title":"Sheet-Pan Lemon Herb Salmon & Veggies","tags":["Low Carb","Mediterranean","High Fiber","cholesterol"],"video":"https://www.youtube.com/watch?v=dQw4w9WgXcQ","minutes":25,"cals":420,"sodium_mg":280,"added_sugar_g":2,"culture":["Mediterranean"],
-     "blurb":"Omega-3 rich salmon with crisp broccoli and tomatoes. Heart-friendly & weeknight easy.",
-     "cook":[("Preheat & Prep (2m)",120,"Preheat oven 425°F. Trim broccoli, halve tomatoes; pat salmon dry."),("Season (1m)",60,"Toss veg with olive oil, pepper, herbs. Add lemon slices; no added salt."),("Roast (7m)",420,"Roast veggies 7m. Add salmon; brush with lemon & herbs."),("Finish (3m)",180,"Roast 3–5m until salmon flakes. Plate & enjoy.")]
-    },
-    {"id":"r2","title":"DASH Bowl: Quinoa, Roasted Veg, Citrus Vinaigrette","tags":["DASH Diet","High Fiber","hypertension","Plant-forward"],"video":"https://www.youtube.com/watch?v=UxxajLWwzqY","minutes":30,"cals":480,"sodium_mg":190,"added_sugar_g":3,"culture":["Latin","Global"],
-     "blurb":"Low-sodium, potassium-rich power bowl aligned with DASH guidelines.",
-     "cook":[("Quinoa (2m)",120,"Rinse quinoa; add 2:1 water; bring to boil."),("Simmer (6m)",360,"Reduce heat; simmer 12-15m total; fluff."),("Roast Veg (5m)",300,"Roast mixed veg at 425°F with olive oil & pepper."),("Vinaigrette (2m)",120,"Whisk citrus + oil + mustard; no salt add."),("Assemble (2m)",120,"Quinoa + veg + vinaigrette; top with herbs.")]
-    },
-    {"id":"r3","title":"Chicken & Veggie Stir-Fry (No Added Sugar Sauce)","tags":["Low Sugar","diabetes","High Fiber"],"video":"https://www.youtube.com/watch?v=3GwjfUFy6M","minutes":20,"cals":390,"sodium_mg":320,"added_sugar_g":0,"culture":["East Asian","Global"],
-     "blurb":"Quick skillet stir-fry with balanced carbs and smart protein—diabetes-friendly.",
-     "cook":[("Prep (2m)",120,"Slice chicken; chop veg."),("Sear (3m)",180,"Sear chicken; remove. Stir-fry veg 2–3m."),("Sauce (2m)",120,"Soy-lite + ginger + garlic + lemon; no sugar."),("Combine (2m)",120,"Return chicken; toss; serve with brown rice (optional).")]
-    },
-]
+# Result orderings: None keeps catalog order; otherwise ascending by that summary field (ties by catalog order)
+RECIPE_SORTS = {"relevance": None, "sodium": "sodium_mg", "minutes": "minutes", "cals": "cals"}
+RECIPE_PAGE_SIZE = int(secret_or_env("RECIPE_PAGE_SIZE") or 10)
+
+class RecipeIndex:
+    # Posting lists tag -> ids and culture -> ids, built once per catalog. A query is a union over the
+    # selected condition/flag tags intersected with the cultural lens; results are cached per key.
+    def __init__(self, recipes: List[Dict[str, Any]], max_cached: int = 512):
+        self.order = {r["id"]: i for i, r in enumerate(recipes)}
+        self.recipes = {r["id"]: r for r in recipes}
+        by_tag, by_culture = defaultdict(set), defaultdict(set)
+        for r in recipes:
+            for tag in r["tags"]:
+                by_tag[tag].add(r["id"])
+            for c in r.get("culture", []):
+                by_culture[c].add(r["id"])
+        self.by_tag = {k: frozenset(v) for k, v in by_tag.items()}
+        self.by_culture = {k: frozenset(v) for k, v in by_culture.items()}
+        self.by_lens = {lens: frozenset().union(*(self.by_culture.get(c, ()) for c in cultures))
+                        for lens, cultures in CULTURE_TAGS.items()}
+        self.max_cached = max_cached
+        self._results: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def query(self, conditions, flags, culture: str, sort: str = "relevance") -> tuple:
+        key = (frozenset(conditions), frozenset(flags), culture, sort)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+        ids = set().union(*(self.by_tag.get(tag, ()) for tag in key[0] | key[1]))
+        if culture != "global":
+            ids &= self.by_lens.get(culture, frozenset())
+        field = RECIPE_SORTS.get(sort)
+        if field:
+            res = tuple(sorted(ids, key=lambda i: (self.recipes[i].get(field) is None, self.recipes[i].get(field) or 0, self.order[i])))
+        else:
+            res = tuple(sorted(ids, key=self.order.__getitem__))  # catalog order
+        with self._lock:
+            self._results[key] = res
+            while len(self._results) > self.max_cached:
+                self._results.popitem(last=False)
+        return res
+
+# Recipe catalog: one JSON object per line (see data/recipes.jsonl)
+RECIPES_PATH = secret_or_env("RECIPES_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "recipes.jsonl")
+RECIPE_SUMMARY_FIELDS = ("id", "tags", "culture", "minutes", "cals", "sodium_mg", "added_sugar_g")
+
+class RecipeCatalog:
+    # The file is memory-mapped and scanned once. Only a compact summary per recipe stays resident;
+    # full records (title, blurb, video, cook steps) are decoded from the mapping on demand.
+    def __init__(self, path: str, cache_size: int = 256):
+        self.path = path
+        self.summaries: List[Dict[str, Any]] = []
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self._spans: Dict[str, tuple] = {}  # id -> (offset, length) in the mapped file
+        self._mm = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as fh:
+                self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self._scan()
+        self.get = functools.lru_cache(maxsize=cache_size)(self._load)
+        self.index = RecipeIndex(self.summaries)
+
+    def _scan(self):
+        mm, pos = self._mm, 0
+        while pos < len(mm):
+            end = mm.find(b"\n", pos)
+            end = len(mm) if end < 0 else end
+            line = mm[pos:end].strip()
+            if line:
+                r = json.loads(line)
+                summary = {k: r.get(k) for k in RECIPE_SUMMARY_FIELDS}
+                summary["tags"] = tuple(sys.intern(x) for x in r.get("tags", []))
+                summary["culture"] = tuple(sys.intern(x) for x in r.get("culture", []))
+                self.summaries.append(summary)
+                self.by_id[summary["id"]] = summary
+                self._spans[summary["id"]] = (pos, end - pos)
+            pos = end + 1
+
+    def _load(self, rid: str) -> Optional[Dict[str, Any]]:
+        span = self._spans.get(rid)
+        if span is None:
+            return None
+        off, n = span
+        rec = json.loads(self._mm[off:off + n])
+        rec["cook"] = [tuple(step) for step in rec.get("cook", [])]
+        return rec
+
+    def __len__(self):
+        return len(self.summaries)
+
+@st.cache_resource(max_entries=2)
+def get_catalog(path: str, mtime: float) -> RecipeCatalog:
+    # mtime in the key reloads the catalog when the file is replaced
+    return RecipeCatalog(path)
+
+CATALOG = get_catalog(RECIPES_PATH, os.path.getmtime(RECIPES_PATH) if os.path.exists(RECIPES_PATH) else 0.0)
 
 RESOURCE_LINKS = [
     ("CDC – Chronic Disease", "https://www.cdc.gov/chronic-disease/prevention/index.html"),
@@ -352,14 +500,14 @@ RESOURCE_LINKS = [
     ("FindHelp (local support)", "https://www.findhelp.org/"),
 ]
 
-# Community demo events by ZIP
+# Community demo events (weekly; "time" is the recurring slot) with the venue's coordinates
 COMMUNITY_DEMO = {
   "01610": [
-      {"name":"Saturday Park Walk","time":"Sat 9:00 AM","loc":"Elm Park Loop","desc":"2 laps easy pace."},
-      {"name":"Low-Impact Indoor","time":"Sun 10:00 AM","loc":"Community Center","desc":"8-minute sequence."},
+      {"name":"Saturday Park Walk","time":"Sat 9:00 AM","loc":"Elm Park Loop","desc":"2 laps easy pace.","lat":42.2733,"lon":-71.8228},
+      {"name":"Low-Impact Indoor","time":"Sun 10:00 AM","loc":"Community Center","desc":"8-minute sequence.","lat":42.2526,"lon":-71.8023},
   ],
   "02139": [
-      {"name":"Charles River Stroll","time":"Sat 8:30 AM","loc":"River Path","desc":"30-min brisk walk."},
+      {"name":"Charles River Stroll","time":"Sat 8:30 AM","loc":"River Path","desc":"30-min brisk walk.","lat":42.3573,"lon":-71.0929},
   ]
 }
 
@@ -371,94 +519,2012 @@ def get_user_id():
         st.session_state.user_id = str(uuid.uuid4())
     return st.session_state.user_id
 
+# Write-behind: handlers only mark the session dirty; one snapshot per rerun is handed to a
+# background worker that debounces per user, retries with backoff and flushes on shutdown.
+PERSIST_DEBOUNCE_S = float(secret_or_env("PERSIST_DEBOUNCE_S") or 1.5)
+PERSIST_QUEUE_MAX  = int(secret_or_env("PERSIST_QUEUE_MAX") or 256)
+PERSIST_RETRIES    = int(secret_or_env("PERSIST_RETRIES") or 3)
+PERSIST_BATCH_ROWS = int(secret_or_env("PERSIST_BATCH_ROWS") or 500)  # max rows per child-table insert
+PERSIST_REQUEUE_S  = float(secret_or_env("PERSIST_REQUEUE_S") or 30)  # wait before a write that used up its retries is tried again
+# "delta": send only changed cc_state columns; vitals readings, dose confirmations and N-of-1
+# observations go as inserts into append-only tables. "full": legacy whole-row upsert.
+PERSIST_MODE       = (secret_or_env("PERSIST_MODE") or "delta").lower()
+PERSIST_DELTA      = PERSIST_MODE != "full"
+
+# Append-only child tables (delta mode); DDL for these and every cc_state column is in schema.sql:
+#   cc_vitals(user_id, ts, bp_sys, bp_dia, glucose, weight)
+#   cc_med_doses(user_id, med_id, date, taken, ts)
+#   cc_n1_obs(user_id, exp_id, date, phase, value, ts)
+
+log = logging.getLogger("carecompanion")
+
+class PersistWorker:
+    def __init__(self, debounce_s: float, maxsize: int, retries: int, requeue_s: float):
+        self.debounce_s = debounce_s
+        self.retries = retries
+        self.requeue_s = requeue_s
+        self.maxsize = maxsize
+        self.q = queue.Queue()   # user_ids waiting for a flush (bounded by maxsize in submit, not here: the worker re-queues)
+        self.pending: Dict[str, Dict[str, Any]] = {}  # user_id -> latest coalesced snapshot
+        self.lock = threading.Lock()
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cc-persist", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, client, user_id: str, users_row: Optional[Dict[str, Any]], state_row: Dict[str, Any],
+               appends: Optional[List[tuple]] = None, snapshot_row: Optional[Dict[str, Any]] = None):
+        with self.lock:
+            item = self.pending.get(user_id)
+            if item:  # already queued: merge newer columns over older ones, keep appends in order
+                item["client"] = client
+                item["state"].update(state_row)
+                item["appends"].extend(appends or [])
+                if users_row is not None:
+                    item["users"] = users_row
+                if snapshot_row is not None:
+                    item["snapshot"] = snapshot_row
+                return
+            self.pending[user_id] = {"due": time.monotonic() + self.debounce_s, "client": client,
+                                     "users": users_row, "state": dict(state_row), "appends": list(appends or []),
+                                     "snapshot": snapshot_row}
+        if self.q.qsize() >= self.maxsize:
+            # Backpressure: write inline rather than drop the snapshot
+            self._flush_user(user_id)
+        else:
+            self.q.put(user_id)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                user_id = self.q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self.lock:
+                item = self.pending.get(user_id)
+            if item:
+                delay = item["due"] - time.monotonic()
+                if delay > 0:
+                    self._stop.wait(min(delay, self.debounce_s))
+                    if item["due"] > time.monotonic():  # a re-queued failure: don't hold up everyone else
+                        self.q.put(user_id)
+                        continue
+            self._flush_user(user_id)
+
+    def _flush_user(self, user_id: str, requeue: bool = True):
+        with self.lock:
+            item = self.pending.pop(user_id, None)
+        if not item:
+            return
+        for attempt in range(self.retries + 1):
+            try:
+                self._write(item)
+                self.last_error = None
+                return
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if attempt < self.retries:
+                    time.sleep(0.5 * 2 ** attempt)
+        log.warning("Persist failed for %s%s: %s", user_id, ", will retry" if requeue else "", self.last_error)
+        if requeue:
+            self._requeue(user_id, item)
+
+    def _requeue(self, user_id: str, item: Dict[str, Any]):
+        # The sessions already count these columns as saved (delta baseline), so a failed write is put
+        # back rather than dropped. Anything submitted meanwhile is newer and merges over it.
+        with self.lock:
+            newer = self.pending.get(user_id)
+            if newer:
+                item["client"] = newer["client"]
+                item["state"].update(newer["state"])
+                item["appends"].extend(newer["appends"])
+                if newer["users"] is not None:
+                    item["users"] = newer["users"]
+                if newer["snapshot"] is not None:
+                    item["snapshot"] = newer["snapshot"]
+            item["due"] = time.monotonic() + self.requeue_s
+            self.pending[user_id] = item
+        if not newer:  # a newer item is already queued under this user_id
+            self.q.put(user_id)
+
+    def _write(self, item: Dict[str, Any]):
+        client = item["client"]
+        if item["users"] is not None:
+            client.table("cc_users").upsert(item["users"]).execute()
+            item["users"] = None  # don't repeat on a retry of the state upsert
+        if len(item["state"]) > 1:  # more than just user_id
+            client.table("cc_state").upsert(item["state"]).execute()
+            item["state"] = {"user_id": item["state"]["user_id"]}
+        if item.get("snapshot") is not None:
+            client.table("cc_care_snapshots").upsert(item["snapshot"]).execute()
+            item["snapshot"] = None
+        # Batched inserts per child table; only rows that didn't land are kept for a retry
+        by_table = defaultdict(list)
+        for tbl, row in item["appends"]:
+            by_table[tbl].append(row)
+        done = {tbl: 0 for tbl in by_table}
+        try:
+            for tbl, rows in by_table.items():
+                while done[tbl] < len(rows):
+                    client.table(tbl).insert(rows[done[tbl]:done[tbl] + PERSIST_BATCH_ROWS]).execute()
+                    done[tbl] += PERSIST_BATCH_ROWS
+        finally:
+            item["appends"] = [(tbl, row) for tbl, rows in by_table.items() for row in rows[done[tbl]:]]
+
+    def close(self):
+        self._stop.set()
+        for user_id in list(self.pending):
+            self._flush_user(user_id, requeue=False)
+
+@st.cache_resource
+def get_persist_worker() -> PersistWorker:
+    return PersistWorker(PERSIST_DEBOUNCE_S, PERSIST_QUEUE_MAX, PERSIST_RETRIES, PERSIST_REQUEUE_S)
+
+_SCALAR_FIELDS = ["xp", "quiz_streak", "boss_unlocked", "boss_cleared", "sodium_budget_mg",
+                  "sugar_budget_g", "steps", "goal", "zip", "culture", "tz"]
+_JSON_FIELDS = ["conditions", "flags", "meals_today", "vitals", "meds", "events", "n1", "nutrition", "week_log", "step_log"]
+
+def _persist_view(field: str):
+    # What a cc_state column holds. In delta mode the append-only histories live in child tables,
+    # so the column only carries the small, rarely-changing part.
+    v = st.session_state.get(field)
+    if field == "meds":  # adherence calendars serialize to a compact bitmap
+        return [{**{k: x for k, x in m.items() if k != "adherence"}, "adherence": med_calendar(m).dumps()} for m in (v or [])]
+    if field == "step_log":
+        return v.dumps()
+    if field == "steps":  # today's count, kept for readers of the old column
+        return st.session_state.step_log.today()
+    if not PERSIST_DELTA:
+        return v
+    if field == "n1" and not (v or {}).get("obs_pending"):  # pending: still the only full copy of its observations
+        return {k: x for k, x in (v or {}).items() if k != "obs"}
+    return v
+
+def _json_view(field: str):
+    v = _persist_view(field)
+    return v.to_records() if field == "vitals" else v
+
+def _column(field: str):
+    return _persist_view(field) if field in _SCALAR_FIELDS else json.dumps(_json_view(field))
+
+def _persisted_columns() -> Dict[str, Any]:
+    # Fields still waiting on a lazy load haven't changed, so they're left out
+    cols = {f: _persist_view(f) for f in _SCALAR_FIELDS}
+    for f in _JSON_FIELDS:
+        if (PERSIST_DELTA and f == "vitals") or is_lazy(st.session_state.get(f)):
+            continue
+        cols[f] = _column(f)
+    return cols
+
+def _state_payload(user_id: str) -> Dict[str, Any]:
+    cols = _persisted_columns()
+    if PERSIST_DELTA:
+        last = st.session_state.get("_persisted", {})
+        st.session_state._persisted = {**last, **cols}
+        cols = {k: v for k, v in cols.items() if k not in last or last[k] != v}
+    return {"user_id": user_id, **cols}
+
+# Read by other sessions and replicas rather than standing in for a JSON column, so written in either mode
+_SHARED_TABLES = {"cc_events"}
+
+def persist_append(table: str, row: Dict[str, Any]):
+    # Queue a row for an append-only child table (delta mode); full mode re-sends the JSON column instead.
+    if not SUPABASE:
+        return
+    if PERSIST_DELTA or table in _SHARED_TABLES:
+        st.session_state.setdefault("_persist_outbox", []).append((table, {"user_id": get_user_id(), **row}))
+    st.session_state._persist_dirty = True
+
 def supabase_upsert_state():
+    # Cheap: just marks the session dirty. supabase_flush_state() does the write once per rerun.
     if not SUPABASE:
         return
+    st.session_state._persist_dirty = True
+
+def supabase_flush_state():
+    if SUPABASE and not st.session_state.get("_loaded"):
+        return  # the load failed: stay dirty rather than overwrite the stored row with defaults
+    snapshot_row = publish_care_snapshot()
+    if not SUPABASE or not (st.session_state.get("_persist_dirty") or snapshot_row):
+        return
+    st.session_state._persist_dirty = False
     user_id = get_user_id()
-    SUPABASE.table("cc_users").upsert({"user_id": user_id, "name": st.session_state.get("name","Alex")}).execute()
-    payload = {
-        "user_id": user_id,
-        "xp": st.session_state.get("xp",0),
-        "quiz_streak": st.session_state.get("quiz_streak",0),
-        "boss_unlocked": st.session_state.get("boss_unlocked",False),
-        "boss_cleared": st.session_state.get("boss_cleared",False),
-        "sodium_budget_mg": st.session_state.get("sodium_budget_mg",1500),
-        "sugar_budget_g": st.session_state.get("sugar_budget_g",25),
-        "steps": st.session_state.get("steps",0),
-        "goal": st.session_state.get("goal",8000),
-        "zip": st.session_state.get("zip",""),
-        "conditions": json.dumps(st.session_state.get("conditions",[])),
-        "flags": json.dumps(st.session_state.get("flags",[])),
-        "meals_today": json.dumps(st.session_state.get("meals_today",[])),
-        "vitals": json.dumps(st.session_state.get("vitals",[])),
-        "meds": json.dumps(st.session_state.get("meds",[])),
-        "events": json.dumps(st.session_state.get("events",[])),
-        "n1": json.dumps(st.session_state.get("n1",{})),
-        "culture": st.session_state.get("culture","global"),
-    }
-    SUPABASE.table("cc_state").upsert(payload).execute()
+    name = st.session_state.get("name","Alex")
+    users_row = None
+    if st.session_state.get("_persisted_name") != name:
+        users_row = {"user_id": user_id, "name": name}
+        st.session_state._persisted_name = name
+    state_row = _state_payload(user_id)
+    appends = st.session_state.get("_persist_outbox", [])
+    st.session_state._persist_outbox = []
+    if users_row is None and len(state_row) == 1 and not appends and snapshot_row is None:
+        return
+    get_persist_worker().submit(SUPABASE, user_id, users_row, state_row, appends, snapshot_row)
+
+# Projected load: the header/scalar columns (plus the small JSON ones every rerun reads) come in one
+# narrow select; each heavy collection is fetched concurrently on the io pool and only decoded when
+# the session first touches it.
+_EAGER_FIELDS = _SCALAR_FIELDS + ["conditions", "flags", "meals_today", "nutrition", "week_log", "step_log"]
+_LAZY_FIELDS  = ["vitals", "meds", "events", "n1"]
+
+class LazyField:
+    # Session-state stand-in for a collection whose fetch is still in flight. The first real use waits
+    # for the fetch, decodes, and swaps the value into session state; every later use of the same proxy
+    # (e.g. a local alias) goes to that one decoded object.
+    # Streamlit re-executes this file every rerun, so a proxy from the load run is an instance of an older
+    # LazyField class: test for one with is_lazy(), never isinstance().
+    __slots__ = ("field", "future", "decode", "default", "_value")
+    _UNSET = object()
+    _cc_lazy = True
+
+    def __init__(self, field: str, future, decode, default):
+        self.field, self.future, self.decode, self.default = field, future, decode, default
+        self._value = type(self)._UNSET
+
+    def resolve(self):
+        if self._value is type(self)._UNSET:
+            try:
+                raw = self.future.result()
+                self._value = self.default if raw is None else self.decode(raw)
+            except Exception as e:
+                log.warning("Lazy load of %s failed: %s", self.field, e)
+                st.toast(f"Couldn't load {self.field}: {e}", icon="⚠️")
+                self._value = self.default
+            if st.session_state.get(self.field) is self:
+                st.session_state[self.field] = self._value
+                if "_persisted" in st.session_state and not (PERSIST_DELTA and self.field == "vitals"):
+                    st.session_state._persisted[self.field] = _column(self.field)
+                    if self.field in st.session_state.get("_lazy_upgraded", ()):  # the decode upgraded an old row: save it
+                        st.session_state._lazy_upgraded.discard(self.field)
+                        del st.session_state._persisted[self.field]
+                        supabase_upsert_state()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __setitem__(self, key, value):
+        self.resolve()[key] = value
+
+    def __contains__(self, key):
+        return key in self.resolve()
+
+    def __bool__(self):
+        return bool(self.resolve())
+
+def is_lazy(v) -> bool:
+    return getattr(type(v), "_cc_lazy", False)
+
+# Fetchers run on the io pool and must not touch session state; they return raw rows (None = no data)
+def _fetch_column(user_id: str, field: str):
+    res = sb_execute(SUPABASE.table("cc_state").select(field).eq("user_id", user_id))
+    return res.data[0].get(field) if res.data else None
+
+def _fetch_vitals(user_id: str):
+    # The JSON column, plus (delta mode) the append-only table. Delta mode stops rewriting the column,
+    # so it keeps the readings taken before the switch; the decode drops readings present in both.
+    col = _fetch_column(user_id, "vitals")
+    rows = json.loads(col) if col else []
+    if PERSIST_DELTA:
+        rows += sb_execute(SUPABASE.table("cc_vitals").select("ts,bp_sys,bp_dia,glucose,weight").eq("user_id", user_id).order("ts")).data or []
+    return rows or None
+
+def _fetch_meds(user_id: str):
+    col = _fetch_column(user_id, "meds")
+    if not col:
+        return None
+    meds = json.loads(col)
+    # Meds saved with an adherence bitmap are complete; older ones replay their dose log once
+    legacy = [m["id"] for m in meds if "adherence" not in m]
+    doses = []
+    if PERSIST_DELTA and legacy:
+        doses = sb_execute(SUPABASE.table("cc_med_doses").select("med_id,date,taken").eq("user_id", user_id).in_("med_id", legacy).order("ts")).data or []
+    return meds, doses
+
+def _fetch_n1(user_id: str):
+    col = _fetch_column(user_id, "n1")
+    if not col:
+        return None
+    n1 = json.loads(col)
+    obs = []
+    if PERSIST_DELTA and n1.get("id"):
+        obs = sb_execute(SUPABASE.table("cc_n1_obs").select("date,phase,value").eq("user_id", user_id).eq("exp_id", n1["id"]).order("ts")).data
+    return n1, obs
+
+def _decode_meds(raw) -> List[Dict[str, Any]]:
+    meds, doses = raw
+    by_id = {m["id"]: m for m in meds}
+    for m in meds:
+        med_calendar(m)
+    for d in doses:
+        m = by_id.get(d["med_id"])
+        if m:
+            day = dt.date.fromisoformat(d["date"])
+            med_calendar(m).mark(day) if d["taken"] else med_calendar(m).unmark(day)
+    return meds
+
+def _decode_vitals(rows) -> "VitalsStore":
+    store = VitalsStore()
+    store.add_new(rows)
+    return store
+
+def _decode_n1(raw) -> Dict[str, Any]:
+    n1, obs = raw
+    if not PERSIST_DELTA:
+        return n1
+    if n1 and not n1.get("id"):  # saved before cc_n1_obs existed: its observations live in the column
+        n1["id"] = str(uuid.uuid4())
+        n1["obs_pending"] = True
+        st.session_state.setdefault("_lazy_upgraded", set()).add("n1")
+    if n1.get("obs_pending"):
+        # Copy the column's observations into cc_n1_obs; the column keeps them (and stays authoritative)
+        # until a load finds every one of them stored, which retires the flag.
+        stored = Counter((o["date"], o["phase"], float(o["value"])) for o in obs)
+        missing = []
+        for o in n1.get("obs", []):
+            key = (o["date"], o["phase"], float(o["value"]))
+            if stored[key]:
+                stored[key] -= 1
+            else:
+                missing.append(o)
+        for o in missing:
+            persist_append("cc_n1_obs", {"exp_id": n1["id"], **o, "ts": f"{o['date']}T00:00:00"})
+        if not missing:
+            n1.pop("obs_pending")
+            st.session_state.setdefault("_lazy_upgraded", set()).add("n1")
+    elif obs:
+        n1["obs"] = obs
+    return n1
+
+_LAZY_LOADERS = {  # field -> (fetch, decode)
+    "vitals": (_fetch_vitals, _decode_vitals),
+    "meds":   (_fetch_meds, _decode_meds),
+    "events": (lambda user_id: _fetch_column(user_id, "events"), json.loads),
+    "n1":     (_fetch_n1, _decode_n1),
+}
+
+def _sync_reminders_when_loaded(user_id: str, tz: str):
+    # The scheduler only needs id/name/dose/time, so it's fed from the raw fetch without decoding
+    def done(fut):
+        if not fut.exception() and fut.result():
+            get_reminder_scheduler().sync_user(user_id, fut.result()[0], tz)
+    return done
 
 def supabase_load_state():
     if not SUPABASE:
         return
     user_id = get_user_id()
+    pool = get_io_pool()
+    futures = {f: pool.submit(fetch, user_id) for f, (fetch, _) in _LAZY_LOADERS.items()}
+    shares = pool.submit(_fetch_share_prefs, user_id)
     try:
-        res = SUPABASE.table("cc_state").select("*").eq("user_id", user_id).execute()
-        if res.data:
-            row = res.data[0]
-            st.session_state.xp = row.get("xp", st.session_state.xp)
-            st.session_state.quiz_streak = row.get("quiz_streak", st.session_state.quiz_streak)
-            st.session_state.boss_unlocked = row.get("boss_unlocked", st.session_state.boss_unlocked)
-            st.session_state.boss_cleared = row.get("boss_cleared", st.session_state.boss_cleared)
-            st.session_state.sodium_budget_mg = row.get("sodium_budget_mg", st.session_state.sodium_budget_mg)
-            st.session_state.sugar_budget_g = row.get("sugar_budget_g", st.session_state.sugar_budget_g)
-            st.session_state.steps = row.get("steps", st.session_state.steps)
-            st.session_state.goal = row.get("goal", st.session_state.goal)
-            st.session_state.zip = row.get("zip", st.session_state.zip)
-            st.session_state.conditions = json.loads(row.get("conditions", json.dumps(st.session_state.conditions)))
-            st.session_state.flags = json.loads(row.get("flags", json.dumps(st.session_state.flags)))
-            st.session_state.meals_today = json.loads(row.get("meals_today", json.dumps(st.session_state.meals_today)))
-            st.session_state.vitals = json.loads(row.get("vitals", json.dumps(st.session_state.vitals)))
-            st.session_state.meds = json.loads(row.get("meds", json.dumps(st.session_state.meds)))
-            st.session_state.events = json.loads(row.get("events", json.dumps(st.session_state.events)))
-            st.session_state.n1 = json.loads(row.get("n1", json.dumps(st.session_state.n1)))
-            st.session_state.culture = row.get("culture", st.session_state.culture)
+        res = sb_execute(SUPABASE.table("cc_state").select(",".join(_EAGER_FIELDS)).eq("user_id", user_id))
     except Exception as e:
         st.sidebar.warning(f"Load failed: {e}")
+        if getattr(e, "code", None) == "42703":  # undefined column
+            st.sidebar.caption("The cc_state table predates this version: apply schema.sql.")
+        return
+    d = st.session_state
+    d._loaded = True  # only after a successful read: until then nothing is saved over the stored row
+    try:
+        d.share_prefs = shares.result()
+    except Exception as e:
+        log.warning("Share preferences load failed: %s", e)
+    if not res.data:
+        return  # new user: keep the defaults; the in-flight fetches just find nothing
+    row = res.data[0]
+    for f in ("xp", "quiz_streak", "boss_unlocked", "boss_cleared", "sodium_budget_mg", "sugar_budget_g", "goal", "zip", "culture"):
+        d[f] = row.get(f, d[f])
+    d.tz = row.get("tz") or d.tz
+    for f in ("conditions", "flags", "meals_today"):
+        if row.get(f):
+            d[f] = json.loads(row[f])
+    if row.get("step_log"):
+        d.step_log = StepLedger.loads(json.loads(row["step_log"]), d.goal)
+    else:  # rows saved before the step history existed: the old counter becomes today
+        d.step_log = StepLedger(goal=d.goal)
+        d.step_log.add(int(row.get("steps") or 0))
+    if row.get("week_log"):
+        d.week_log = json.loads(row["week_log"])
+    if row.get("nutrition"):
+        d.nutrition = json.loads(row["nutrition"])
+    else:  # rows saved before the ledger existed
+        ledger_rebuild(d.meals_today)
+    for f, fut in futures.items():
+        default = d[f].default if is_lazy(d[f]) else d[f]  # never wrap a proxy in a proxy
+        d[f] = LazyField(f, fut, _LAZY_LOADERS[f][1], default)
+    futures["meds"].add_done_callback(_sync_reminders_when_loaded(user_id, d.tz))
+    d._reminders_synced = True
+    d._persisted = _persisted_columns()
 
 # ---------------------------
 # Live context (OpenWeather/Mapbox)
 # ---------------------------
-def geocode_zip(zip_code: str):
-    if not OPENWEATHER_API_KEY:
+# Shared across sessions: geocodes never expire, weather/AQI live LIVE_CTX_TTL_S and are keyed by a
+# rounded lat/lon grid cell so nearby ZIPs share one entry.
+LIVE_CTX_TTL_S   = float(secret_or_env("LIVE_CTX_TTL_S") or 600)
+LIVE_CTX_RETRY_S = float(secret_or_env("LIVE_CTX_RETRY_S") or 20)  # re-prefetch delay when weather/AQI came back missing
+LIVE_CTX_MAX     = int(secret_or_env("LIVE_CTX_CACHE_MAX") or 4096)
+GRID_DECIMALS    = 2  # ~1 km cells
+HTTP_TIMEOUT_S   = float(secret_or_env("HTTP_TIMEOUT_S") or 4)  # per-call deadline for live-context calls
+
+class TTLCache:
+    # LRU with per-entry TTL (None = never expires). Expired entries are returned immediately while
+    # a single background refresh per key replaces them.
+    def __init__(self, maxsize: int, pool: ThreadPoolExecutor):
+        self.maxsize = maxsize
+        self.pool = pool
+        self.data: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (value, expires_at|None)
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    # ttl may also be a callable of the loaded value (e.g. shorter for partial results)
+    def get_or_load(self, key, loader, ttl=None):
+        with self.lock:
+            hit = self.data.get(key)
+            if hit is not None:
+                self.data.move_to_end(key)
+                value, expires = hit
+                if expires is not None and time.monotonic() >= expires and key not in self.refreshing:
+                    self.refreshing.add(key)
+                    self.pool.submit(self._refresh, key, loader, ttl)
+                return value
+        value = loader()
+        self.put(key, value, ttl)
+        return value
+
+    def put(self, key, value, ttl=None):
+        if value is None:  # never pin a failed lookup
+            return
+        if callable(ttl):
+            ttl = ttl(value)
+        with self.lock:
+            self.data[key] = (value, None if ttl is None else time.monotonic() + ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def _refresh(self, key, loader, ttl):
+        try:
+            self.put(key, loader(), ttl)
+        except Exception as e:
+            log.info("Refresh of %s failed, keeping stale value: %s", key, e)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+@st.cache_resource
+def get_background_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="cc-bg")
+
+@st.cache_resource
+def get_io_pool() -> ThreadPoolExecutor:
+    # Leaf HTTP calls only (never submits further work), so it can't deadlock behind the background pool
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="cc-io")
+
+@st.cache_resource
+def get_live_cache() -> TTLCache:
+    return TTLCache(LIVE_CTX_MAX, get_background_pool())
+
+@st.cache_resource
+def get_http() -> requests.Session:
+    # One keep-alive session per process; urllib3 pools connections per host
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+    return http
+
+# Upstream protection. Each host has one process-wide breaker: BREAKER_FAILS failures or slow answers
+# (> BREAKER_SLOW_S) within BREAKER_WINDOW_S open it; while open, calls fail at once; after
+# BREAKER_OPEN_S one half-open probe decides between closing and re-opening. On the script thread
+# every call is also capped by what's left of the rerun's LIVE_CTX_BUDGET_S.
+OPENWEATHER_HOST = "api.openweathermap.org"
+MAPBOX_HOST      = "api.mapbox.com"
+BREAKER_FAILS    = int(secret_or_env("BREAKER_FAILS") or 3)
+BREAKER_WINDOW_S = float(secret_or_env("BREAKER_WINDOW_S") or 60)
+BREAKER_SLOW_S   = float(secret_or_env("BREAKER_SLOW_S") or 2.5)
+BREAKER_OPEN_S   = float(secret_or_env("BREAKER_OPEN_S") or 30)
+LIVE_CTX_BUDGET_S = float(secret_or_env("LIVE_CTX_BUDGET_S") or 3)
+
+class CircuitBreaker:
+    def __init__(self, host: str, fails: int = BREAKER_FAILS, window_s: float = BREAKER_WINDOW_S,
+                 slow_s: float = BREAKER_SLOW_S, open_s: float = BREAKER_OPEN_S):
+        self.host, self.fails, self.window_s, self.slow_s, self.open_s = host, fails, window_s, slow_s, open_s
+        self.state = "closed"
+        self.bad = deque()  # monotonic times of recent failures/slow calls
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def available(self) -> bool:
+        # Would a call be let through now? (doesn't claim the half-open probe)
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                return time.monotonic() - self.opened_at >= self.open_s
+            return not self.probing
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.open_s:
+                self.state, self.probing = "half_open", False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, ok: bool, elapsed: float):
+        bad = not ok or elapsed > self.slow_s
+        now = time.monotonic()
+        with self.lock:
+            if self.state == "half_open":
+                self.probing = False
+                if bad:
+                    self.state, self.opened_at = "open", now
+                else:
+                    self.state = "closed"
+                    self.bad.clear()
+                return
+            if not bad:
+                return
+            self.bad.append(now)
+            while self.bad and now - self.bad[0] > self.window_s:
+                self.bad.popleft()
+            if self.state == "closed" and len(self.bad) >= self.fails:
+                self.state, self.opened_at = "open", now
+                log.warning("Circuit for %s opened after %d failures/slow calls", self.host, len(self.bad))
+
+@st.cache_resource
+def get_breakers() -> Dict[str, CircuitBreaker]:
+    return {}
+
+def breaker(host: str) -> CircuitBreaker:
+    b = get_breakers()
+    return b.get(host) or b.setdefault(host, CircuitBreaker(host))
+
+_rerun = threading.local()
+
+def start_latency_budget():
+    # Called at the top of every (full or fragment) rerun on the script thread
+    _rerun.deadline = time.monotonic() + LIVE_CTX_BUDGET_S
+
+def budget_left(timeout: float) -> float:
+    # `timeout` capped by the current rerun's remaining budget (uncapped off the script thread)
+    deadline = getattr(_rerun, "deadline", None)
+    return timeout if deadline is None else min(timeout, deadline - time.monotonic())
+
+def _http_get(http: requests.Session, url: str, timeout: float) -> Optional[requests.Response]:
+    b = breaker(urllib.parse.urlsplit(url).hostname)
+    timeout = budget_left(timeout)
+    if timeout < 0.1 or not b.allow():
         return None
+    t0 = time.monotonic()
     try:
-        url = f"https://api.openweathermap.org/geo/1.0/zip?zip={zip_code},US&appid={OPENWEATHER_API_KEY}"
-        r = requests.get(url, timeout=8)
-        if r.ok:
-            d = r.json()
-            return {"lat": d.get("lat"), "lon": d.get("lon"), "name": d.get("name")}
+        r = http.get(url, timeout=(min(3.05, timeout), timeout))
     except Exception:
+        b.record(False, time.monotonic() - t0)
         return None
+    b.record(r.status_code < 500 and r.status_code != 429, time.monotonic() - t0)
+    return r
+
+def _get_json(http: requests.Session, url: str, timeout: float):
+    r = _http_get(http, url, timeout)
+    try:
+        return r.json() if r is not None and r.ok else None
+    except ValueError:
+        return None
+
+def _geocode_zip_remote(zip_code: str, http: requests.Session):
+    d = _get_json(http, f"https://{OPENWEATHER_HOST}/geo/1.0/zip?zip={zip_code},US&appid={OPENWEATHER_API_KEY}", HTTP_TIMEOUT_S)
+    if d:
+        return {"lat": d.get("lat"), "lon": d.get("lon"), "name": d.get("name")}
+    return None
+
+# Offline ZIP -> centroid table. The source is a CSV (zip,lat,lon[,name]) or the Census ZCTA Gazetteer
+# (tab-separated GEOID, INTPTLAT, INTPTLONG); it's compiled once into fixed-width records sorted by ZIP,
+# which are memory-mapped, so a lookup is a binary search touching a few pages (~36 B/row on disk).
+ZIP_GAZETTEER_SRC = secret_or_env("ZIP_GAZETTEER_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "zip_centroids.csv")
+ZIP_GAZETTEER_MAGIC = b"CCZIP01\0"
+ZIP_DTYPE = np.dtype([("zip", "<u4"), ("lat", "<f4"), ("lon", "<f4"), ("name", "S24")])
+
+def _name24(name: str) -> bytes:
+    # UTF-8, cut to the 24-byte field on a character boundary
+    return name.encode()[:24].decode("utf-8", "ignore").encode()
+
+def _read_zip_source(path: str) -> np.ndarray:
+    with open(path, encoding="utf-8-sig", newline="") as fh:
+        head = fh.readline()
+        fh.seek(0)
+        reader = csv.DictReader(fh, delimiter="\t" if "\t" in head else ",")
+        rows = []
+        for raw in reader:
+            row = {_norm_key(k): (v or "").strip() for k, v in raw.items() if k}
+            z, lat, lon = row.get("zip") or row.get("geoid"), row.get("lat") or row.get("intptlat"), row.get("lon") or row.get("intptlong")
+            try:
+                rows.append((int(z), float(lat), float(lon), _name24(row.get("name", ""))))
+            except (TypeError, ValueError):
+                continue
+    arr = np.array(rows, dtype=ZIP_DTYPE)
+    arr.sort(order="zip")
+    return arr
+
+def build_zip_gazetteer(src: str, dst: str):
+    arr = _read_zip_source(src)
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(ZIP_GAZETTEER_MAGIC)
+        fh.write(arr.tobytes())
+    os.replace(tmp, dst)
+
+class ZipGazetteer:
+    def __init__(self, src: str):
+        self._mm = None
+        dst = os.path.splitext(src)[0] + ".bin"
+        if not os.path.exists(src) and not os.path.exists(dst):
+            self.rows = np.empty(0, dtype=ZIP_DTYPE)
+            return
+        try:
+            if os.path.exists(src) and (not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src)):
+                build_zip_gazetteer(src, dst)
+            with open(dst, "rb") as fh:
+                self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._mm[:len(ZIP_GAZETTEER_MAGIC)] != ZIP_GAZETTEER_MAGIC:
+                raise ValueError(f"{dst} is not a ZIP gazetteer")
+            self.rows = np.frombuffer(self._mm, dtype=ZIP_DTYPE, offset=len(ZIP_GAZETTEER_MAGIC))
+        except (OSError, ValueError) as e:  # e.g. read-only deploy: keep the compiled table in memory instead
+            log.info("ZIP gazetteer not memory-mapped (%s); loading %s in memory", e, src)
+            self.rows = _read_zip_source(src)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, zip_code: str) -> Optional[Dict[str, Any]]:
+        if len(zip_code) != 5 or not zip_code.isdigit() or not len(self.rows):
+            return None
+        z = int(zip_code)
+        zips = self.rows["zip"]
+        i = int(np.searchsorted(zips, z))
+        if i >= len(zips) or zips[i] != z:
+            return None
+        r = self.rows[i]
+        return {"lat": round(float(r["lat"]), 5), "lon": round(float(r["lon"]), 5), "name": r["name"].decode("utf-8", "ignore") or f"ZIP {zip_code}"}
+
+@st.cache_resource(max_entries=2)
+def get_zip_gazetteer(path: str, mtime: float) -> ZipGazetteer:
+    return ZipGazetteer(path)
+
+def zip_lookup(zip_code: str) -> Optional[Dict[str, Any]]:
+    # Opened on first use rather than at import, so sessions that never need a location don't pay for it
+    path = ZIP_GAZETTEER_SRC
+    return get_zip_gazetteer(path, os.path.getmtime(path) if os.path.exists(path) else 0.0).lookup(zip_code)
+
+def geocode_zip(zip_code: str):
+    # Bundled gazetteer first; the OpenWeather geocoder only for ZIPs it doesn't have
+    zip_code = (zip_code or "").strip()
+    hit = zip_lookup(zip_code)
+    if hit or not OPENWEATHER_API_KEY:
+        return hit
+    http = get_http()
+    return get_live_cache().get_or_load(("geo", zip_code), lambda: _geocode_zip_remote(zip_code, http))
+
+def _fetch_weather_aqi_remote(lat: float, lon: float, http: requests.Session, pool: ThreadPoolExecutor):
+    # Both calls in flight at once; whatever hasn't answered by the deadline is dropped (partial result)
+    base = f"https://{OPENWEATHER_HOST}/data/2.5"
+    timeout = budget_left(HTTP_TIMEOUT_S)  # the pool threads don't carry the rerun's budget themselves
+    fw = pool.submit(_get_json, http, f"{base}/weather?lat={lat}&lon={lon}&units=imperial&appid={OPENWEATHER_API_KEY}", timeout)
+    fa = pool.submit(_get_json, http, f"{base}/air_pollution?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}", timeout)
+    wait([fw, fa], timeout=max(0.0, timeout))
+    weather = fw.result() if fw.done() else None
+    aqi = fa.result() if fa.done() else None
+    return (weather, aqi) if (weather or aqi) else None
+
+def _live_ctx_ttl(res) -> float:
+    # Partial results are retried sooner
+    return LIVE_CTX_TTL_S if all(res) else min(60.0, LIVE_CTX_TTL_S)
 
 def fetch_weather_aqi(lat: float, lon: float):
     if not OPENWEATHER_API_KEY:
         return None, None
-    weather = None
-    aqi = None
+    glat, glon = round(lat, GRID_DECIMALS), round(lon, GRID_DECIMALS)
+    http, pool = get_http(), get_io_pool()
+    res = get_live_cache().get_or_load(("wx", glat, glon), lambda: _fetch_weather_aqi_remote(glat, glon, http, pool), ttl=_live_ctx_ttl)
+    return res or (None, None)
+
+# Per-session prefetch of the Exercise tab's live context (geocode + weather/AQI for the profile ZIP),
+# started right after the state load so the tab usually finds it ready. The job runs on the background
+# pool and only writes into its own LivePrefetch; the script thread is the only one touching session state.
+class LivePrefetch:
+    def __init__(self, zip_code: str, prev: Optional["LivePrefetch"] = None):
+        self.zip = zip_code
+        self.started = time.monotonic()
+        self.stale = False  # set when the ZIP changes; a running job stops publishing
+        self.geo = None
+        self.weather = self.aqi = None
+        if prev is not None and prev.zip == zip_code:  # a refresh: keep showing the last values meanwhile
+            self.geo, self.weather, self.aqi = prev.geo, prev.weather, prev.aqi
+        self.future = None
+
+    def run(self):
+        try:
+            geo = geocode_zip(self.zip)
+            if self.stale:
+                return
+            self.geo = geo
+            if geo and geo.get("lat") is not None and OPENWEATHER_API_KEY and breaker(OPENWEATHER_HOST).available():
+                weather, aqi = fetch_weather_aqi(geo["lat"], geo["lon"])
+                if not self.stale:
+                    self.weather, self.aqi = weather or self.weather, aqi or self.aqi
+        except Exception as e:
+            log.info("Live context prefetch for %s failed: %s", self.zip, e)
+
+    def cancel(self):
+        self.stale = True
+        if self.future is not None:
+            self.future.cancel()  # only helps if it hasn't started; otherwise `stale` drops its results
+
+    def done(self) -> bool:
+        return self.future is None or self.future.done()
+
+    def complete(self) -> bool:
+        # False when weather or AQI is missing (timeout, open breaker) for a ZIP that has a location
+        located = self.geo and self.geo.get("lat") is not None
+        return not (located and OPENWEATHER_API_KEY) or (self.weather is not None and self.aqi is not None)
+
+def prefetch_live_context() -> LivePrefetch:
+    # Starts the prefetch, or restarts it on a ZIP change, once the last result is older than the weather
+    # TTL, or after LIVE_CTX_RETRY_S when that result came back without weather/AQI
+    d = st.session_state
+    zip_code = (d.get("zip") or "").strip()
+    pf = d.get("_live_prefetch")
+    if pf is not None and pf.zip == zip_code:
+        max_age = LIVE_CTX_TTL_S if pf.complete() else LIVE_CTX_RETRY_S
+        if not pf.done() or time.monotonic() - pf.started < max_age:
+            return pf
+    if pf is not None:
+        pf.cancel()
+    pf = LivePrefetch(zip_code, pf)
+    if zip_code:
+        pf.future = get_background_pool().submit(pf.run)
+    d._live_prefetch = pf
+    return pf
+
+def live_context() -> LivePrefetch:
+    # Waits at most what's left of the rerun's budget, then the caller renders whatever has arrived
+    pf = prefetch_live_context()  # also picks up a ZIP edited inside a fragment rerun
+    if not pf.done():
+        wait([pf.future], timeout=max(0.0, budget_left(HTTP_TIMEOUT_S)))
+    return pf
+
+# Static map images are fetched server-side once per (style, lat, lon, zoom, size) and kept in a
+# content-addressed disk cache (sha256 of the token-free request) with an LRU byte cap, fronted by a
+# small in-memory LRU. The browser gets bytes, never the token-bearing URL.
+MAPBOX_STYLE      = "mapbox/streets-v11"
+MAP_CACHE_DIR     = secret_or_env("MAP_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "carecompanion-maps")
+MAP_CACHE_MAX_MB  = float(secret_or_env("MAP_CACHE_MAX_MB") or 256)
+MAP_CACHE_MEM     = int(secret_or_env("MAP_CACHE_MEM_ITEMS") or 64)
+MAP_COORD_DECIMALS = 4  # ~11 m; nearer requests share an image
+
+class MapImageCache:
+    def __init__(self, root: str, max_bytes: int, mem_items: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.mem_items = mem_items
+        self.mem: "OrderedDict[str, bytes]" = OrderedDict()
+        self.disk: "OrderedDict[str, int]" = OrderedDict()  # digest -> size, least recently used first
+        self.disk_bytes = 0
+        self.inflight: Dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        found = []
+        for sub in os.listdir(root):
+            d = os.path.join(root, sub)
+            if os.path.isdir(d):
+                for name in os.listdir(d):
+                    if name.endswith(".img"):
+                        stat = os.stat(os.path.join(d, name))
+                        found.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, digest, size in sorted(found):  # oldest first = eviction order
+            self.disk[digest] = size
+            self.disk_bytes += size
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest + ".img")
+
+    def get(self, request: str, fetch) -> Optional[bytes]:
+        # request: canonical token-free description; fetch() -> bytes or None
+        digest = hashlib.sha256(request.encode()).hexdigest()
+        with self.lock:
+            data = self.mem.get(digest)
+            if data is not None:
+                self.mem.move_to_end(digest)
+                return data
+            gate = self.inflight.setdefault(digest, threading.Lock())
+        with gate:  # one fetch per image however many sessions ask at once
+            data = self._read(digest)
+            if data is None:
+                data = fetch()
+                if data:
+                    self._write(digest, data)
+        with self.lock:
+            self.inflight.pop(digest, None)
+            if data:
+                self.mem[digest] = data
+                self.mem.move_to_end(digest)
+                while len(self.mem) > self.mem_items:
+                    self.mem.popitem(last=False)
+        return data
+
+    def _read(self, digest: str) -> Optional[bytes]:
+        with self.lock:
+            if digest not in self.disk:
+                return None
+            self.disk.move_to_end(digest)
+        try:
+            path = self._path(digest)
+            with open(path, "rb") as fh:
+                data = fh.read()
+            os.utime(path)  # mtime carries the LRU order across restarts
+            return data
+        except OSError:
+            with self.lock:
+                self.disk_bytes -= self.disk.pop(digest, 0)
+            return None
+
+    def _write(self, digest: str, data: bytes):
+        path = self._path(digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.info("Map cache write failed: %s", e)
+            return
+        with self.lock:
+            self.disk_bytes += len(data) - self.disk.pop(digest, 0)
+            self.disk[digest] = len(data)
+            victims = []
+            while self.disk_bytes > self.max_bytes and len(self.disk) > 1:
+                old, size = self.disk.popitem(last=False)
+                self.disk_bytes -= size
+                self.mem.pop(old, None)
+                victims.append(old)
+        for old in victims:
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+
+@st.cache_resource
+def get_map_cache() -> MapImageCache:
+    return MapImageCache(MAP_CACHE_DIR, int(MAP_CACHE_MAX_MB * 1024 * 1024), MAP_CACHE_MEM)
+
+def _fetch_mapbox(path: str) -> Optional[bytes]:
+    r = _http_get(get_http(), f"https://{MAPBOX_HOST}/styles/v1/{path}?access_token={MAPBOX_TOKEN}", HTTP_TIMEOUT_S)
+    if r is not None and r.ok and r.headers.get("content-type", "").startswith("image/"):
+        return r.content
+    return None
+
+def mapbox_static(lat, lon, zoom: int = 14, size: str = "600x300") -> Optional[bytes]:
+    # Image bytes for st.image (None without a token or when Mapbox can't be reached)
+    if not MAPBOX_TOKEN:
+        return None
+    lat, lon = round(float(lat), MAP_COORD_DECIMALS), round(float(lon), MAP_COORD_DECIMALS)
+    path = f"{MAPBOX_STYLE}/static/pin-s+f30({lon},{lat})/{lon},{lat},{zoom}/{size}"
+    return get_map_cache().get(path, lambda: _fetch_mapbox(path))
+
+# ---------------------------
+# Community places (events + parks)
+# ---------------------------
+# One process-wide store of geolocated events and parks. Each kind has a uniform lat/lon grid
+# (GEO_CELL_DEG ≈ 7 mi of latitude), so a radius query only visits the few cells overlapping its
+# bounding box and does an exact distance check on what it finds there.
+#   cc_events(user_id, id, name, "when", loc, "desc", lat, lon)
+GEO_CELL_DEG      = 0.1
+EVENT_RADIUS_MI   = float(secret_or_env("EVENT_RADIUS_MI") or 10)
+PARK_RADIUS_MI    = float(secret_or_env("PARK_RADIUS_MI") or 5)
+SHARED_EVENTS_MAX = int(secret_or_env("SHARED_EVENTS_MAX") or 200000)  # upcoming events read at startup
+_WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+def miles_between(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 7917.6 * math.asin(math.sqrt(min(1.0, a)))
+
+def next_weekly(slot: str, now: Optional[dt.datetime] = None) -> dt.datetime:
+    # "Sat 9:00 AM" -> the next such local datetime
+    now = now or dt.datetime.now()
+    day, clock = slot.split(" ", 1)
+    at = dt.datetime.strptime(clock.strip(), "%I:%M %p").time()
+    ahead = (_WEEKDAYS.index(day[:3].lower()) - now.weekday()) % 7
+    when = dt.datetime.combine(now.date() + dt.timedelta(days=ahead), at)
+    return when if when > now else when + dt.timedelta(days=7)
+
+class GeoGrid:
+    # Each cell keeps {id: (lat, lon, key)} plus numpy columns rebuilt lazily after it changes, so a
+    # query is a handful of vectorized distance checks; `key` is what results get ordered by.
+    def __init__(self, cell_deg: float = GEO_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.cells: Dict[tuple, Dict[str, tuple]] = defaultdict(dict)
+        self.cols: Dict[tuple, tuple] = {}  # cell -> (ids, lat, lon, key) arrays; dropped on change
+        self.where: Dict[str, tuple] = {}  # id -> cell
+
+    def _cell(self, lat: float, lon: float) -> tuple:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def __len__(self):
+        return len(self.where)
+
+    def insert(self, item_id: str, lat: float, lon: float, key: float = 0.0):
+        self.remove(item_id)
+        cell = self._cell(lat, lon)
+        self.cells[cell][item_id] = (lat, lon, key)
+        self.cols.pop(cell, None)
+        self.where[item_id] = cell
+
+    def remove(self, item_id: str):
+        cell = self.where.pop(item_id, None)
+        if cell is not None:
+            bucket = self.cells[cell]
+            bucket.pop(item_id, None)
+            self.cols.pop(cell, None)
+            if not bucket:
+                del self.cells[cell]
+
+    def _columns(self, cell: tuple) -> tuple:
+        cols = self.cols.get(cell)
+        if cols is None:
+            bucket = self.cells[cell]
+            vals = np.array(list(bucket.values()), dtype=np.float64).reshape(-1, 3)
+            cols = self.cols[cell] = (np.array(list(bucket), dtype=object), vals[:, 0], vals[:, 1], vals[:, 2])
+        return cols
+
+    def near(self, lat: float, lon: float, miles: float) -> tuple:
+        # (ids, distances_mi, keys) of everything within `miles`, unordered
+        dlat = miles / 69.0
+        dlon = miles / max(1e-6, 69.17 * math.cos(math.radians(lat)))
+        (r0, c0), (r1, c1) = self._cell(lat - dlat, lon - dlon), self._cell(lat + dlat, lon + dlon)
+        parts = [self._columns(cell) for cell in itertools.product(range(r0, r1 + 1), range(c0, c1 + 1)) if cell in self.cells]
+        if not parts:
+            return np.empty(0, dtype=object), np.empty(0), np.empty(0)
+        ids, lats, lons, keys = (np.concatenate(c) for c in zip(*parts))
+        p1, p2 = math.radians(lat), np.radians(lats)
+        a = np.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * np.cos(p2) * np.sin(np.radians(lons - lon) / 2) ** 2
+        d = 7917.6 * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+        ok = d <= miles
+        return ids[ok], d[ok], keys[ok]
+
+class CommunityStore:
+    def __init__(self):
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.grids = {"event": GeoGrid(), "park": GeoGrid()}
+        self.lock = threading.Lock()
+
+    def add(self, kind: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        # item needs "lat"/"lon"; events also a "when" ISO datetime (their sort key), and recurring ones a
+        # "weekly" slot like "Sat 9:00 AM" that "when" rolls forward along. Returns the stored item.
+        item = {**item, "kind": kind, "id": item.get("id") or str(uuid.uuid4())}
+        key = dt.datetime.fromisoformat(item["when"]).timestamp() if kind == "event" else 0.0
+        with self.lock:
+            self.items[item["id"]] = item
+            self.grids[kind].insert(item["id"], float(item["lat"]), float(item["lon"]), key)
+        return item
+
+    def remove(self, item_id: str):
+        with self.lock:
+            item = self.items.pop(item_id, None)
+            if item:
+                self.grids[item["kind"]].remove(item_id)
+
+    def events_near(self, lat: float, lon: float, miles: float, limit: int = 50) -> List[Dict[str, Any]]:
+        # Upcoming events within `miles`, soonest first; ones that ended over an hour ago are dropped
+        with self.lock:
+            ids, d, when = self.grids["event"].near(lat, lon, miles)
+            past = when < time.time() - 3600
+            if past.any():
+                for item_id in ids[past]:
+                    self._expire(item_id)
+                ids, d, when = self.grids["event"].near(lat, lon, miles)
+            if len(ids) > limit:
+                top = np.argpartition(when, limit)[:limit]
+                ids, d, when = ids[top], d[top], when[top]
+            order = np.lexsort((d, when))
+            return [{**self.items[i], "miles": float(m)} for i, m in zip(ids[order], d[order])]
+
+    def _expire(self, item_id: str):
+        # Caller holds the lock. One-off events are dropped; weekly ones move to their next occurrence.
+        item = self.items[item_id]
+        if item.get("weekly"):
+            nxt = next_weekly(item["weekly"])
+            item["when"] = nxt.isoformat()
+            self.grids["event"].insert(item_id, float(item["lat"]), float(item["lon"]), nxt.timestamp())
+        else:
+            del self.items[item_id]
+            self.grids["event"].remove(item_id)
+
+    def parks_near(self, lat: float, lon: float, miles: float, limit: int = 20) -> List[Dict[str, Any]]:
+        with self.lock:
+            ids, d, _ = self.grids["park"].near(lat, lon, miles)
+            order = np.argsort(d)[:limit]
+            return [{**self.items[i], "miles": float(m)} for i, m in zip(ids[order], d[order])]
+
+def _load_shared_events(store: CommunityStore):
+    if not SUPABASE:
+        return
     try:
-        w = requests.get(f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&units=imperial&appid={OPENWEATHER_API_KEY}", timeout=8)
-        if w.ok: weather = w.json()
-        a = requests.get(f"https://api.openweathermap.org/data/2.5/air_pollution?lat={lat}&lon={lon}&appid={OPENWEATHER_API_KEY}", timeout=8)
-        if a.ok: aqi = a.json()
-    except Exception:
-        pass
-    return weather, aqi
+        res = sb_execute(SUPABASE.table("cc_events").select("id,name,when,loc,desc,lat,lon")
+                         .gte("when", dt.datetime.now().isoformat()).order("when").limit(SHARED_EVENTS_MAX))
+        for row in res.data or []:
+            store.add("event", row)
+    except Exception as e:
+        log.warning("Shared events load failed: %s", e)
+
+@st.cache_resource
+def get_community_store() -> CommunityStore:
+    store = CommunityStore()
+    for parks in GEO_PARKS.values():
+        for name, lat, lon in parks:
+            store.add("park", {"id": f"park:{name}", "name": name, "lat": lat, "lon": lon})
+    for zip_code, events in COMMUNITY_DEMO.items():
+        for i, e in enumerate(events):
+            store.add("event", {**e, "id": f"demo:{zip_code}:{i}", "when": next_weekly(e["time"]).isoformat(), "weekly": e["time"]})
+    _load_shared_events(store)
+    return store
 
-def mapbox_static(lat, lon):
-    if not MAPBOX_TOKEN:
+# ---------------------------
+# Daily nutrition ledger
+# ---------------------------
+# st.session_state.nutrition = {"today": {"day", "sodium_mg", "added_sugar_g", "cals", "meals"},
+#                               "history": {iso_day: {...same totals...}}}
+# Totals move by O(1) per logged meal; closed days go to history for cheap weekly rollups.
+NUTRIENTS = ("sodium_mg", "added_sugar_g", "cals")
+NUTRITION_HISTORY_DAYS = 120
+
+def _ledger_day(day: str) -> Dict[str, Any]:
+    return {"day": day, "meals": 0, **{k: 0 for k in NUTRIENTS}}
+
+def ledger() -> Dict[str, Any]:
+    # Today's running totals; a date change closes the previous day first
+    led = st.session_state.nutrition
+    if led["today"]["day"] != dt.date.today().isoformat():
+        ledger_close_day()
+    return led["today"]
+
+def ledger_add(rid: str):
+    r = CATALOG.by_id.get(rid)
+    if not r:
+        return
+    cur = ledger()
+    for k in NUTRIENTS:
+        cur[k] += r.get(k) or 0
+    cur["meals"] += 1
+
+def ledger_close_day():
+    led = st.session_state.nutrition
+    cur = led["today"]
+    if cur["meals"]:
+        # End Day can run more than once a day: later batches add to the same history entry
+        h = led["history"].setdefault(cur["day"], {k: 0 for k in ("meals", *NUTRIENTS)})
+        for k in h:
+            h[k] += cur.get(k, 0)
+        while len(led["history"]) > NUTRITION_HISTORY_DAYS:
+            led["history"].pop(min(led["history"]))
+    led["today"] = _ledger_day(dt.date.today().isoformat())
+    st.session_state.meals_today = []
+
+def ledger_rebuild(meal_ids: List[str]):
+    st.session_state.nutrition = {"today": _ledger_day(dt.date.today().isoformat()), "history": {}}
+    for rid in meal_ids:
+        ledger_add(rid)
+
+def ledger_rollup(days: int = 7) -> Dict[str, Any]:
+    # Totals over the last `days` days including today (open totals plus anything End Day already
+    # closed today): O(days) dict lookups
+    led = st.session_state.nutrition
+    cur = ledger()
+    out = {k: cur[k] for k in ("meals", *NUTRIENTS)}
+    today = dt.date.today()
+    for i in range(days):
+        h = led["history"].get((today - dt.timedelta(days=i)).isoformat())
+        if h:
+            for k in out:
+                out[k] += h.get(k, 0)
+    return out
+
+# ---------------------------
+# Daily step history
+# ---------------------------
+STEP_HISTORY_DAYS = 400  # ring capacity: a year plus the longest window
+STEP_WINDOWS = (7, 30)
+
+class StepLedger:
+    # Ring buffer of daily step counts ending at `end` (a date ordinal), with a running sum per window
+    # and the goal-hit streak up to yesterday. Adding steps today, window averages and the streak are
+    # O(1); moving to a new day costs O(days skipped). Back-dated or merged days recompute the streak.
+    def __init__(self, end: Optional[dt.date] = None, counts=(), goal: int = 8000, cap: int = STEP_HISTORY_DAYS):
+        self.cap = cap
+        self.buf = array("I", bytes(4 * cap))
+        self.end = (end or dt.date.today()).toordinal()
+        self.goal = goal
+        self.sums = {w: 0 for w in STEP_WINDOWS}
+        counts = list(counts)[-cap:]  # oldest first, last one is `end`
+        for i, n in enumerate(counts):
+            self.buf[(self.end - len(counts) + 1 + i) % cap] = n
+        self._recount()
+
+    def _recount(self):
+        self.sums = {w: sum(self.buf[(self.end - i) % self.cap] for i in range(w)) for w in STEP_WINDOWS}
+        run = 0
+        for i in range(1, self.cap):
+            if self.buf[(self.end - i) % self.cap] < max(1, self.goal):
+                break
+            run += 1
+        self.prev_streak = run
+
+    def _advance(self, day: int):
+        if day - self.end >= self.cap:
+            self.buf = array("I", bytes(4 * self.cap))
+            self.end = day
+            self._recount()
+            return
+        while self.end < day:
+            hit = self.buf[self.end % self.cap] >= max(1, self.goal)
+            self.prev_streak = self.prev_streak + 1 if hit else 0
+            self.end += 1
+            for w in STEP_WINDOWS:
+                self.sums[w] -= self.buf[(self.end - w) % self.cap]
+            self.buf[self.end % self.cap] = 0
+
+    def _slot(self, day: Optional[dt.date]) -> Optional[int]:
+        d = (day or dt.date.today()).toordinal()
+        if d > self.end:
+            self._advance(d)
+        return d if d > self.end - self.cap else None
+
+    def add(self, n: int, day: Optional[dt.date] = None):
+        d = self._slot(day)
+        if d is None:
+            return
+        self._set(d, max(0, self.buf[d % self.cap] + n))
+        if d < self.end:
+            self._recount()
+
+    def _set(self, d: int, v: int):
+        delta = v - self.buf[d % self.cap]
+        self.buf[d % self.cap] = v
+        for w in STEP_WINDOWS:
+            if d > self.end - w:
+                self.sums[w] += delta
+
+    def merge(self, daily: Dict[dt.date, int]) -> int:
+        # Bulk import of per-day totals (e.g. a wearable export): a day keeps the larger of the two
+        # counts so manual adds aren't lost. Returns how many days changed.
+        if daily:
+            self._slot(max(daily))
+        changed = 0
+        for day, n in daily.items():
+            d = day.toordinal()
+            if self.end - self.cap < d <= self.end and n > self.buf[d % self.cap]:
+                self._set(d, int(n))
+                changed += 1
+        if changed:
+            self._recount()
+        return changed
+
+    def set_goal(self, goal: int):
+        if goal != self.goal:
+            self.goal = goal
+            self._recount()
+
+    def today(self) -> int:
+        self._slot(None)
+        return self.buf[self.end % self.cap]
+
+    def avg(self, window: int) -> int:
+        self._slot(None)
+        return round(self.sums[window] / window)
+
+    def streak(self) -> int:
+        # Goal-hit days up to today; today not reaching the goal yet doesn't break the streak
+        self._slot(None)  # roll forward first: prev_streak is only current once the ledger is at today
+        return self.prev_streak + (1 if self.buf[self.end % self.cap] >= max(1, self.goal) else 0)
+
+    def series(self, days: int) -> List[tuple]:
+        # [(date, steps)] for the last `days` days, oldest first
+        self._slot(None)
+        days = min(days, self.cap)
+        return [(dt.date.fromordinal(d), self.buf[d % self.cap]) for d in range(self.end - days + 1, self.end + 1)]
+
+    def dumps(self) -> Dict[str, Any]:
+        # Only the span back to the oldest non-zero day is stored
+        n = next((i for i in range(self.cap - 1, -1, -1) if self.buf[(self.end - i) % self.cap]), 0) + 1
+        days = array("I", (self.buf[(self.end - i) % self.cap] for i in range(n - 1, -1, -1)))
+        return {"end": dt.date.fromordinal(self.end).isoformat(), "days": base64.b64encode(days.tobytes()).decode()}
+
+    @classmethod
+    def loads(cls, d: Dict[str, Any], goal: int) -> "StepLedger":
+        days = array("I")
+        days.frombytes(base64.b64decode(d["days"]))
+        return cls(dt.date.fromisoformat(d["end"]), days, goal)
+
+# Wearable exports: one row per day (CSV or JSON), streamed like the vitals import
+_STEP_DATE_KEYS = ("date", "day", "start_date", "timestamp", "ts")
+_STEP_COUNT_KEYS = ("steps", "step_count", "total_steps", "value")
+
+def import_steps(fh, kind: str, steps: "StepLedger") -> Dict[str, Any]:
+    reasons: Dict[str, int] = {}
+    rows = _readable_rows(_iter_json_rows(fh) if kind == "json" else _iter_csv_rows(fh), reasons)
+    daily: Dict[dt.date, int] = defaultdict(int)
+    rejected = 0
+    for raw in rows:
+        row = {_norm_key(k): v for k, v in raw.items()} if isinstance(raw, dict) else {}
+        ts = _parse_ts(str(next((row[k] for k in _STEP_DATE_KEYS if row.get(k)), "")))
+        try:
+            n = int(float(next(row[k] for k in _STEP_COUNT_KEYS if row.get(k) not in (None, ""))))
+        except (StopIteration, TypeError, ValueError):
+            n = -1
+        if not ts or n < 0:
+            rejected += 1
+            continue
+        daily[dt.date.fromisoformat(ts[:10])] += n  # several rows per day (e.g. hourly) add up
+    return {"days": len(daily), "changed": steps.merge(daily), "rejected": rejected, "reasons": reasons}
+
+# ---------------------------
+# Vitals store
+# ---------------------------
+VITAL_FIELDS = ("bp_sys", "bp_dia", "glucose", "weight")
+VITAL_LABELS = {"bp_sys": "Systolic", "bp_dia": "Diastolic", "glucose": "Glucose", "weight": "Weight"}
+VITAL_LIMITS = {"bp_sys": (70, 240), "bp_dia": (40, 140), "glucose": (40, 500), "weight": (60.0, 600.0)}  # same as the inputs
+TREND_WINDOWS_DAYS = (7, 30, 90)
+DAY_S = 86400
+CHART_POINTS = int(secret_or_env("CHART_POINTS") or 400)  # default points per series sent to the browser
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> tuple:
+    # Largest-Triangle-Three-Buckets: keeps first/last points and, per bucket, the point forming the
+    # largest triangle with the previous pick and the next bucket's average — preserves peaks and dips.
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+    xf = x.astype(np.float64)
+    every = (n - 2) / (n_out - 2)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = xf[end:nxt_end].mean(), y[end:nxt_end].mean()
+        area = np.abs((xf[a] - avg_x) * (y[start:end] - y[a]) - (xf[a] - xf[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        idx[i + 1] = a
+    return x[idx], y[idx]
+
+def _epoch(ts: str) -> int:
+    return int(dt.datetime.fromisoformat(ts).timestamp())
+
+class VitalsStore:
+    # Columnar vitals history: sorted int64 epoch seconds plus one float64 array per measure
+    # (NaN = not measured in that reading). Capacity doubles, so append is amortized O(1); time
+    # windows are two binary searches and rolling statistics are vectorized over the arrays.
+    def __init__(self, records=()):
+        self.n = 0
+        self.ts = np.empty(64, dtype=np.int64)
+        self.cols = {f: np.empty(64, dtype=np.float64) for f in VITAL_FIELDS}
+        self.version = 0  # bumped on every change; lets callers cache derived data
+        self._charts: Dict[tuple, tuple] = {}  # (field, days, points, day) -> (version, x, y)
+        self.extend(records)
+
+    def __len__(self):
+        return self.n
+
+    def _reserve(self, extra: int):
+        need = self.n + extra
+        if need <= len(self.ts):
+            return
+        cap = max(need, 2 * len(self.ts))
+        self.ts = np.resize(self.ts, cap)
+        self.cols = {f: np.resize(a, cap) for f, a in self.cols.items()}
+
+    @staticmethod
+    def _value(rec: Dict[str, Any], f: str) -> float:
+        v = rec.get(f)
+        return np.nan if v is None or v == "" else float(v)
+
+    def append(self, rec: Dict[str, Any]):
+        t = _epoch(rec["ts"])
+        if self.n and t < self.ts[self.n - 1]:
+            return self.extend([rec])  # out of order: merge path
+        self._reserve(1)
+        self.ts[self.n] = t
+        for f in VITAL_FIELDS:
+            self.cols[f][self.n] = self._value(rec, f)
+        self.n += 1
+        self.version += 1
+
+    def extend(self, records) -> int:
+        # Sorted merge of a batch; returns how many rows were added
+        records = list(records)
+        if not records:
+            return 0
+        ts = np.fromiter((_epoch(r["ts"]) for r in records), dtype=np.int64, count=len(records))
+        vals = {f: np.fromiter((self._value(r, f) for r in records), dtype=np.float64, count=len(records)) for f in VITAL_FIELDS}
+        return self._merge(ts, vals)
+
+    def _merge(self, ts: np.ndarray, vals: Dict[str, np.ndarray]) -> int:
+        n0 = self.n
+        all_ts = np.concatenate([self.ts[:n0], ts])
+        order = np.argsort(all_ts, kind="stable")
+        self._reserve(len(ts))
+        self.ts[:len(order)] = all_ts[order]
+        for f in VITAL_FIELDS:
+            self.cols[f][:len(order)] = np.concatenate([self.cols[f][:n0], vals[f]])[order]
+        self.n = len(order)
+        self.version += 1
+        return self.n - n0
+
+    def add_new(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Insert readings whose timestamp isn't stored yet (first wins within the batch); returns them
+        if not records:
+            return []
+        ts = np.fromiter((_epoch(r["ts"]) for r in records), dtype=np.int64, count=len(records))
+        _, first = np.unique(ts, return_index=True)
+        first.sort()
+        known = self.ts[:self.n]
+        pos = np.searchsorted(known, ts[first])
+        dup = (pos < self.n) & (known[np.minimum(pos, max(self.n - 1, 0))] == ts[first]) if self.n else np.zeros(len(first), bool)
+        fresh = [records[i] for i in first[~dup]]
+        self.extend(fresh)
+        return fresh
+
+    def span(self, t0: Optional[float] = None, t1: Optional[float] = None) -> tuple:
+        # Index range [i0, i1) of readings with t0 <= ts < t1
+        ts = self.ts[:self.n]
+        i0 = 0 if t0 is None else int(np.searchsorted(ts, t0, "left"))
+        i1 = self.n if t1 is None else int(np.searchsorted(ts, t1, "left"))
+        return i0, i1
+
+    def slice(self, t0: Optional[float] = None, t1: Optional[float] = None) -> Dict[str, np.ndarray]:
+        i0, i1 = self.span(t0, t1)
+        return {"ts": self.ts[i0:i1], **{f: a[i0:i1] for f, a in self.cols.items()}}
+
+    def _window(self, field: str, days: int, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        i0, i1 = self.span(now - days * DAY_S, now + 1)
+        y = self.cols[field][i0:i1]
+        ok = ~np.isnan(y)
+        return self.ts[i0:i1][ok], y[ok]
+
+    def count(self, field: str, days: int, now: Optional[float] = None) -> int:
+        return len(self._window(field, days, now)[1])
+
+    def mean(self, field: str, days: int, now: Optional[float] = None) -> float:
+        _, y = self._window(field, days, now)
+        return float(y.mean()) if len(y) else float("nan")
+
+    def slope(self, field: str, days: int, now: Optional[float] = None) -> float:
+        # Least-squares trend in units per day over the window
+        x, y = self._window(field, days, now)
+        if len(y) < 2 or x[-1] == x[0]:
+            return float("nan")
+        x = (x - x.mean()) / DAY_S
+        return float((x * (y - y.mean())).sum() / (x * x).sum())
+
+    def rolling_mean(self, field: str, days: int) -> np.ndarray:
+        # Trailing `days`-day mean at every reading, via prefix sums (NaNs excluded)
+        ts, y = self.ts[:self.n], self.cols[field][:self.n]
+        ok = ~np.isnan(y)
+        csum = np.concatenate([[0.0], np.cumsum(np.where(ok, y, 0.0))])
+        ccnt = np.concatenate([[0], np.cumsum(ok)])
+        left = np.searchsorted(ts, ts - days * DAY_S, "left")
+        cnt = ccnt[1:] - ccnt[left]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(cnt > 0, (csum[1:] - csum[left]) / cnt, np.nan)
+
+    def downsample(self, field: str, days: int, points: int) -> tuple:
+        # Chart series for the last `days` days (0 = all), LTTB-reduced to `points`. Cached until the
+        # next append; the calendar day is part of the key so relative ranges roll over at midnight.
+        key = (field, days, points, dt.date.today().toordinal())
+        hit = self._charts.get(key)
+        if hit and hit[0] == self.version:
+            return hit[1], hit[2]
+        d = self.slice(time.time() - days * DAY_S if days else None, None)
+        ok = ~np.isnan(d[field])
+        x, y = lttb(d["ts"][ok], d[field][ok], points)
+        if len(self._charts) > 32:
+            self._charts.clear()
+        self._charts[key] = (self.version, x, y)
+        return x, y
+
+    def record(self, i: int) -> Dict[str, Any]:
+        rec = {"ts": dt.datetime.fromtimestamp(int(self.ts[i])).isoformat(timespec="seconds")}
+        for f in VITAL_FIELDS:
+            v = self.cols[f][i]
+            rec[f] = None if np.isnan(v) else (float(v) if f == "weight" else int(v))
+        return rec
+
+    def last(self) -> Optional[Dict[str, Any]]:
+        return self.record(self.n - 1) if self.n else None
+
+    def tail(self, k: int) -> List[Dict[str, Any]]:
+        # Newest first
+        return [self.record(i) for i in range(self.n - 1, max(-1, self.n - 1 - k), -1)]
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        return [self.record(i) for i in range(self.n)]
+
+# Bulk import of home-device exports (CSV, JSON array or JSON Lines), parsed as a stream in chunks
+VITALS_IMPORT_CHUNK = 5000
+_VITAL_ALIASES = {
+    "ts": ("ts", "timestamp", "datetime", "date_time", "measured_at", "date"),
+    "time": ("time",),
+    "bp_sys": ("bp_sys", "systolic", "sys", "sbp", "systolic_mmhg"),
+    "bp_dia": ("bp_dia", "diastolic", "dia", "dbp", "diastolic_mmhg"),
+    "glucose": ("glucose", "blood_glucose", "bg", "glucose_mg_dl"),
+    "weight": ("weight", "weight_lb", "weight_lbs"),
+}
+_ALIAS_TO_FIELD = {a: f for f, names in _VITAL_ALIASES.items() for a in names}
+
+def _norm_key(k: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in str(k).strip().lower()).strip("_").replace("__", "_")
+
+def _iter_csv_rows(fh):
+    text = io.TextIOWrapper(fh, encoding="utf-8-sig", newline="")
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        text.detach()  # leave the uploaded file open
+
+def _iter_json_rows(fh, bufsize: int = 1 << 16):
+    # Streams either a top-level JSON array or JSON Lines without loading the whole file
+    text = io.TextIOWrapper(fh, encoding="utf-8-sig")
+    try:
+        yield from _decode_stream(text, bufsize)
+    finally:
+        text.detach()
+
+def _readable_rows(rows, reasons: Dict[str, int]):
+    # Stops at the first undecodable spot (bad encoding, truncated/invalid JSON, broken CSV) and records it
+    # as a reason; rows read before it still count
+    try:
+        yield from rows
+    except (ValueError, csv.Error) as e:  # JSONDecodeError and UnicodeDecodeError are ValueErrors
+        reason = f"unreadable file ({type(e).__name__}), rest skipped"
+        reasons[reason] = reasons.get(reason, 0) + 1
+
+def _decode_stream(text, bufsize: int):
+    dec = json.JSONDecoder()
+    buf, eof = "", False
+    while True:
+        buf = buf.lstrip(" \t\r\n,")
+        if buf.startswith("["):
+            buf = buf[1:]
+            continue
+        if buf.startswith("]"):
+            return
+        try:
+            obj, end = dec.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                if buf.strip():
+                    raise
+                return
+            chunk = text.read(bufsize)
+            eof = not chunk
+            buf += chunk
+            continue
+        yield obj
+        buf = buf[end:]
+
+def _parse_ts(raw: str) -> Optional[str]:
+    raw = (raw or "").strip()
+    for parse in (dt.datetime.fromisoformat, lambda v: dt.datetime.strptime(v, "%m/%d/%Y %H:%M"),
+                  lambda v: dt.datetime.strptime(v, "%m/%d/%Y %I:%M %p"), lambda v: dt.datetime.strptime(v, "%m/%d/%Y")):
+        try:
+            return parse(raw).isoformat(timespec="seconds")
+        except ValueError:
+            continue
+    return None
+
+def _clean_vitals_row(raw: Dict[str, Any]) -> tuple:
+    # -> (record, None) or (None, reason). Out-of-range values reject the row, as the inputs would.
+    row = {}
+    for k, v in raw.items():
+        f = _ALIAS_TO_FIELD.get(_norm_key(k))
+        if f and f not in row and v not in (None, ""):
+            row[f] = v
+    ts = _parse_ts(f"{row['ts']} {row['time']}" if "time" in row and "ts" in row else str(row.get("ts", "")))
+    if not ts:
+        return None, "missing/invalid timestamp"
+    rec = {"ts": ts}
+    for f, (lo, hi) in VITAL_LIMITS.items():
+        if f not in row:
+            rec[f] = None
+            continue
+        try:
+            v = float(row[f])
+        except (TypeError, ValueError):
+            return None, f"non-numeric {f}"
+        if not lo <= v <= hi:
+            return None, f"{f} out of range ({lo}–{hi})"
+        rec[f] = v if f == "weight" else int(round(v))
+    if all(rec[f] is None for f in VITAL_FIELDS):
+        return None, "no measurements"
+    return rec, None
+
+def import_vitals(fh, kind: str, store: "VitalsStore", on_chunk=None) -> Dict[str, Any]:
+    # Validates, dedupes on timestamp and appends chunk by chunk; new rows are queued for cc_vitals
+    stats = {"added": 0, "duplicates": 0, "rejected": 0, "reasons": {}}
+    rows = _readable_rows(_iter_json_rows(fh) if kind == "json" else _iter_csv_rows(fh), stats["reasons"])
+    chunk: List[Dict[str, Any]] = []
+
+    def flush():
+        fresh = store.add_new(chunk)
+        stats["added"] += len(fresh)
+        stats["duplicates"] += len(chunk) - len(fresh)
+        for rec in fresh:
+            persist_append("cc_vitals", rec)
+        supabase_flush_state()  # hand each chunk to the persist worker instead of growing the outbox
+        chunk.clear()
+        if on_chunk:
+            on_chunk(stats)
+
+    for raw in rows:
+        rec, reason = _clean_vitals_row(raw) if isinstance(raw, dict) else (None, "not an object")
+        if rec is None:
+            stats["rejected"] += 1
+            stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+            continue
+        chunk.append(rec)
+        if len(chunk) >= VITALS_IMPORT_CHUNK:
+            flush()
+    flush()
+    return stats
+
+# ---------------------------
+# Medication adherence
+# ---------------------------
+class AdherenceCalendar:
+    # One flag per day counted from `start`. Alongside it: prefix[i] = taken days before offset i, and
+    # run[i] = consecutive taken days ending at offset i. Marking today touches O(1) entries (an older
+    # day only shifts the tail after it), and window adherence/current streak are O(1) lookups.
+    # Serialized as {"start", "n", "bits"} with the flags bit-packed and base64-encoded.
+    def __init__(self, start: dt.date, flags=b""):
+        self.start = start
+        self.days = bytearray()
+        self.prefix = array("I", [0])
+        self.run = array("I")
+        for f in flags:
+            self._push(1 if f else 0)
+
+    def _push(self, f: int):
+        self.days.append(f)
+        self.prefix.append(self.prefix[-1] + f)
+        self.run.append((self.run[-1] + 1 if self.run else 1) if f else 0)
+
+    def _offset(self, day: dt.date) -> int:
+        off = (day - self.start).days
+        if off < 0:  # rebase to an earlier start (rare: back-dated entries)
+            flags = bytes(-off) + bytes(self.days)
+            self.__init__(day, flags)
+            off = 0
+        while len(self.days) <= off:
+            self._push(0)
+        return off
+
+    def is_set(self, day: dt.date) -> bool:
+        off = (day - self.start).days
+        return 0 <= off < len(self.days) and bool(self.days[off])
+
+    def _set(self, day: dt.date, f: int) -> bool:
+        off = self._offset(day)
+        if self.days[off] == f:
+            return False
+        self.days[off] = f
+        step = 1 if f else -1
+        for i in range(off + 1, len(self.prefix)):
+            self.prefix[i] += step
+        for i in range(off, len(self.days)):
+            new = (self.run[i - 1] + 1 if i else 1) if self.days[i] else 0
+            if i > off and new == self.run[i]:
+                break
+            self.run[i] = new
+        return True
+
+    def mark(self, day: dt.date) -> bool:
+        return self._set(day, 1)
+
+    def unmark(self, day: dt.date) -> bool:
+        return self._set(day, 0)
+
+    def rate(self, window: int, today: Optional[dt.date] = None) -> float:
+        # Share of days taken over the last `window` days (only days since start count)
+        off = ((today or dt.date.today()) - self.start).days
+        if off < 0:
+            return 0.0
+        lo = max(0, off - window + 1)
+        hi = min(off + 1, len(self.days))
+        taken = self.prefix[hi] - self.prefix[min(lo, hi)]
+        return taken / (off + 1 - lo)
+
+    def streak(self, today: Optional[dt.date] = None) -> int:
+        # Consecutive days up to today; a day not yet marked today doesn't break yesterday's streak
+        off = ((today or dt.date.today()) - self.start).days
+        for i in (off, off - 1):
+            if 0 <= i < len(self.days) and self.days[i]:
+                return self.run[i]
+        return 0
+
+    def dumps(self) -> Dict[str, Any]:
+        packed = np.packbits(np.frombuffer(bytes(self.days), dtype=np.uint8), bitorder="little")
+        return {"start": self.start.isoformat(), "n": len(self.days), "bits": base64.b64encode(packed.tobytes()).decode()}
+
+    @classmethod
+    def loads(cls, d: Dict[str, Any]) -> "AdherenceCalendar":
+        packed = np.frombuffer(base64.b64decode(d["bits"]), dtype=np.uint8)
+        flags = np.unpackbits(packed, count=int(d["n"]), bitorder="little").tobytes()
+        return cls(dt.date.fromisoformat(d["start"]), flags)
+
+    @classmethod
+    def from_dates(cls, dates: List[str]) -> "AdherenceCalendar":
+        days = sorted(dt.date.fromisoformat(x) for x in dates)
+        cal = cls(days[0] if days else dt.date.today())
+        for day in days:
+            cal.mark(day)
+        return cal
+
+def med_calendar(m: Dict[str, Any]) -> AdherenceCalendar:
+    # The med's calendar, decoding a stored bitmap or migrating a legacy taken_dates list on first use
+    cal = m.get("adherence")
+    if not hasattr(cal, "mark"):
+        cal = AdherenceCalendar.loads(cal) if cal else AdherenceCalendar.from_dates(m.get("taken_dates", []))
+        m["adherence"] = cal
+    m.pop("taken_dates", None)
+    return cal
+
+# ---------------------------
+# Medication reminders
+# ---------------------------
+# One process-wide min-heap of next-due doses across all users: (due_epoch, seq, key) with
+# key = (user_id, med_id, "HH:MM"). Removals are lazy (the entry's seq no longer matches), so adds,
+# removes and fires are O(log n) and a tick only touches the doses that are actually due.
+# The heap is filled from cc_state at start-up and re-read every REMINDER_RELOAD_S (sessions sync their
+# own changes immediately). Every replica schedules everyone; a claim row per dose in
+#   cc_reminders_sent(user_id, med_id, due) unique (user_id, med_id, due)
+# decides which one sends it.
+DEFAULT_TZ         = secret_or_env("DEFAULT_TZ") or "America/New_York"
+REMINDER_TZS       = ["America/New_York", "America/Chicago", "America/Denver", "America/Phoenix",
+                      "America/Los_Angeles", "America/Anchorage", "Pacific/Honolulu", "America/Puerto_Rico", "UTC"]
+REMINDER_BATCH     = int(secret_or_env("REMINDER_BATCH") or 500)      # max reminders per notifier call
+REMINDER_MAX_IDLE_S = float(secret_or_env("REMINDER_MAX_IDLE_S") or 30)
+REMINDER_GRACE_S   = float(secret_or_env("REMINDER_GRACE_S") or 3600)  # doses later than this are skipped, not sent
+REMINDER_RELOAD_S  = float(secret_or_env("REMINDER_RELOAD_S") or 900)
+REMINDER_PAGE      = int(secret_or_env("REMINDER_PAGE") or 1000)       # cc_state rows per page of a reload
+
+def parse_dose_times(raw: str) -> List[str]:
+    # "8:00, 20:30" -> ["08:00", "20:30"]; raises ValueError on anything that isn't 24h HH:MM
+    out = []
+    for part in (raw or "").replace(";", ",").split(","):
+        part = part.strip()
+        if part:
+            out.append(dt.datetime.strptime(part, "%H:%M").strftime("%H:%M"))
+    return sorted(set(out))
+
+def _tz(name: Optional[str]) -> dt.tzinfo:
+    try:
+        return ZoneInfo(name or DEFAULT_TZ)
+    except (ZoneInfoNotFoundError, ValueError):
+        return dt.timezone.utc
+
+def next_dose_at(hhmm: str, tz: dt.tzinfo, after: float) -> float:
+    # Next wall-clock HH:MM in `tz` strictly after epoch `after`; built per local date, so DST shifts hold
+    h, m = map(int, hhmm.split(":"))
+    day = dt.datetime.fromtimestamp(after, tz).date()
+    while True:
+        due = dt.datetime.combine(day, dt.time(h, m), tzinfo=tz).timestamp()
+        if due > after:
+            return due
+        day += dt.timedelta(days=1)
+
+def log_notifier(batch: List[Dict[str, Any]]):
+    # Local stand-in for a push/SMS/email sink
+    for r in batch:
+        log.info("Reminder for %s: %s %s at %s (%s)", r["user_id"], r["name"], r["dose"], r["time"], r["tz"])
+
+def load_all_meds(page: int = REMINDER_PAGE):
+    # Every stored user's meds and zone, keyset-paged by user_id
+    last = ""
+    while True:
+        rows = sb_execute(SUPABASE.table("cc_state").select("user_id,meds,tz").gt("user_id", last).order("user_id").limit(page)).data or []
+        yield from rows
+        if len(rows) < page:
+            return
+        last = rows[-1]["user_id"]
+
+def claim_reminders(batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Keeps the reminders this replica won: only the first insert of a (user_id, med_id, due) row succeeds
+    if not SUPABASE or not batch:
+        return batch
+    rows = [{"user_id": r["user_id"], "med_id": r["med_id"], "due": dt.datetime.fromtimestamp(r["due"], dt.timezone.utc).isoformat()}
+            for r in batch]
+    won = sb_execute(SUPABASE.table("cc_reminders_sent").upsert(rows, on_conflict="user_id,med_id,due", ignore_duplicates=True)).data or []
+    keys = {(w["user_id"], w["med_id"], round(dt.datetime.fromisoformat(w["due"]).timestamp())) for w in won}
+    return [r for r in batch if (r["user_id"], r["med_id"], round(r["due"])) in keys]
+
+class ReminderScheduler:
+    def __init__(self, notifier=log_notifier, batch: int = REMINDER_BATCH, max_idle_s: float = REMINDER_MAX_IDLE_S,
+                 start: bool = True, loader=None, claim=None, reload_s: float = REMINDER_RELOAD_S):
+        self.notifier = notifier
+        self.batch = batch
+        self.max_idle_s = max_idle_s
+        self.loader = loader      # () -> iterable of cc_state rows {user_id, meds, tz}; None = sessions only
+        self.claim = claim        # batch -> the part of it this replica should send; None = send all
+        self.reload_s = reload_s
+        self.next_reload = 0.0
+        self.synced_at: Dict[str, float] = {}  # user_id -> last sync from a session in this process
+        self.heap: List[tuple] = []
+        self.entries: Dict[tuple, Dict[str, Any]] = {}  # key -> {"seq", "due", "med", "tz"}; live doses only
+        self.by_user: Dict[str, set] = defaultdict(set)
+        self.acked: Dict[tuple, str] = {}  # (user_id, med_id) -> local ISO date already taken
+        self.last_error: Optional[str] = None
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._stop = False
+        if start:
+            self._thread = threading.Thread(target=self._run, name="cc-reminders", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _push(self, key: tuple, med: Dict[str, Any], tz: str, now: float):
+        due = next_dose_at(key[2], _tz(tz), now)
+        seq = next(self._seq)
+        self.entries[key] = {"seq": seq, "due": due, "med": med, "tz": tz}
+        heapq.heappush(self.heap, (due, seq, key))
+
+    def sync_user(self, user_id: str, meds: List[Dict[str, Any]], tz: str, now: Optional[float] = None,
+                  read_at: Optional[float] = None):
+        # Diff the user's doses against what's scheduled: new ones are pushed, dropped ones forgotten,
+        # unchanged ones keep their heap entry. Cost is O(doses of this user × log n).
+        # `read_at` marks a sync from storage, skipped if a session synced this user after that read.
+        now = time.time() if now is None else now
+        want = {}
+        for m in meds:
+            try:
+                times = parse_dose_times(m.get("time", ""))
+            except ValueError:
+                continue
+            snap = {"id": m["id"], "name": m.get("name", ""), "dose": m.get("dose", "")}
+            for hhmm in times:
+                want[(user_id, m["id"], hhmm)] = snap
+        with self._cv:
+            if read_at is None:
+                self.synced_at[user_id] = now
+            elif self.synced_at.get(user_id, 0.0) >= read_at:
+                return
+            meds_left = {k[1] for k in want}
+            for key in self.by_user[user_id] - want.keys():
+                self.entries.pop(key, None)
+                if key[1] not in meds_left:
+                    self.acked.pop(key[:2], None)
+            for key, snap in want.items():
+                cur = self.entries.get(key)
+                if cur is not None and cur["tz"] == tz:
+                    cur["med"] = snap  # renamed/redosed: same slot
+                    continue
+                self._push(key, snap, tz, now)
+            self.by_user[user_id] = set(want)
+            if not want:
+                self.by_user.pop(user_id, None)
+            self._compact()
+            self._cv.notify()  # the worker recomputes its wait against the new heap top
+
+    def remove_user(self, user_id: str):
+        self.sync_user(user_id, [], DEFAULT_TZ)
+
+    def reload(self):
+        # Re-read everyone's meds, including doses already marked taken today in their own zone
+        read_at = time.time()
+        n = 0
+        try:
+            for row in self.loader():
+                meds = json.loads(row["meds"]) if row.get("meds") else []
+                tz = row.get("tz") or DEFAULT_TZ
+                self.sync_user(row["user_id"], meds, tz, read_at=read_at)
+                day = dt.datetime.now(_tz(tz)).date()
+                for m in meds:
+                    if med_calendar(m).is_set(day):
+                        with self._cv:
+                            if self.synced_at.get(row["user_id"], 0.0) < read_at:
+                                self.acked[(row["user_id"], m["id"])] = day.isoformat()
+                n += 1
+            log.info("Reminder schedule loaded for %d users (%d doses)", n, len(self))
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            log.warning("Reminder reload failed after %d users: %s", n, self.last_error)
+
+    def ack(self, user_id: str, med_id: str, day: dt.date):
+        # Dose marked taken: today's remaining reminders for this med are suppressed
+        with self._cv:
+            self.acked[(user_id, med_id)] = day.isoformat()
+
+    def unack(self, user_id: str, med_id: str):
+        with self._cv:
+            self.acked.pop((user_id, med_id), None)
+
+    def next_due(self, user_id: str, med_id: str) -> Optional[float]:
+        with self._cv:
+            dues = [self.entries[k]["due"] for k in self.by_user.get(user_id, ()) if k[1] == med_id]
+        return min(dues) if dues else None
+
+    def _compact(self):
+        # Rebuild once dead entries outnumber live ones, keeping the heap O(live)
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.entries):
+            self.heap = [(e["due"], e["seq"], k) for k, e in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def pop_due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Pops up to `limit` doses due at `now` and reschedules each for its next day
+        now = time.time() if now is None else now
+        limit = limit or self.batch
+        out = []
+        with self._cv:
+            while self.heap and self.heap[0][0] <= now and len(out) < limit:
+                due, seq, key = heapq.heappop(self.heap)
+                e = self.entries.get(key)
+                if e is None or e["seq"] != seq:
+                    continue  # removed or superseded
+                tz = _tz(e["tz"])
+                self._push(key, e["med"], e["tz"], max(due, now))
+                local_day = dt.datetime.fromtimestamp(due, tz).date().isoformat()
+                if now - due > REMINDER_GRACE_S or self.acked.get(key[:2]) == local_day:
+                    continue
+                out.append({"user_id": key[0], "med_id": key[1], "time": key[2], "tz": e["tz"], "due": due,
+                            "name": e["med"]["name"], "dose": e["med"]["dose"]})
+        return out
+
+    def _run(self):
+        while True:
+            if self.loader and time.time() >= self.next_reload:  # off this thread, so due doses aren't held up
+                self.next_reload = time.time() + self.reload_s
+                threading.Thread(target=self.reload, name="cc-reminders-load", daemon=True).start()
+            with self._cv:
+                if self._stop:
+                    return
+                delay = self.max_idle_s if not self.heap else min(self.max_idle_s, self.heap[0][0] - time.time())
+                if delay > 0:
+                    self._cv.wait(delay)
+                    continue
+            batch = self.pop_due()
+            if not batch:
+                continue
+            try:
+                if self.claim:
+                    try:
+                        batch = self.claim(batch)
+                    except Exception as e:  # a duplicate beats a missed dose
+                        log.warning("Reminder claim failed, sending unclaimed: %s", e)
+                if batch:
+                    self.notifier(batch)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                log.warning("Reminder notifier failed for %d reminders: %s", len(batch), self.last_error)
+
+    def close(self):
+        with self._cv:
+            self._stop = True
+            self._cv.notify()
+
+@st.cache_resource
+def get_reminder_scheduler() -> ReminderScheduler:
+    return ReminderScheduler(loader=load_all_meds if SUPABASE else None, claim=claim_reminders if SUPABASE else None)
+
+def sync_reminders():
+    # Re-register this user's doses after any change to meds or time zone
+    get_reminder_scheduler().sync_user(get_user_id(), st.session_state.meds, st.session_state.tz)
+
+# ---------------------------
+# Care Circle snapshots
+# ---------------------------
+# The caregiver view reads one small precomputed record per patient instead of the patient's state.
+# st.session_state.week_log = {iso_day: {"lessons": n}} is bumped as events happen; the snapshot is
+# rebuilt from it, the step ledger and the nutrition ledger in O(7) and published only when it changed.
+#   cc_care_snapshots(user_id, snapshot, updated_at)
+CARE_WINDOW_DAYS    = 7
+CARE_SNAPSHOT_TTL_S = float(secret_or_env("CARE_SNAPSHOT_TTL_S") or 30)
+CARE_SNAPSHOT_MAX   = int(secret_or_env("CARE_SNAPSHOT_MAX") or 4096)
+# What a snapshot may contain is decided by the patient's saved share preferences (cc_shares), applied
+# before publishing and again before serving; a link's s/l/m parameters can only hide more.
+DEFAULT_SHARE_PREFS = {"steps": True, "lessons": True, "meals": False}
+CARE_SHARE_FIELDS = {
+    "steps":   ("goal", "steps_today", "steps_avg_7d", "steps_avg_30d", "step_streak"),
+    "lessons": ("lessons_7d", "quiz_streak"),
+    "meals":   ("meals_today", "sodium_mg", "added_sugar_g", "sodium_budget_mg", "sugar_budget_g", "meals_7d"),
+}
+
+def filter_care_snapshot(snap: Dict[str, Any], prefs: Dict[str, bool]) -> Dict[str, Any]:
+    hidden = {f for k, fields in CARE_SHARE_FIELDS.items() if not prefs.get(k) for f in fields}
+    return {k: v for k, v in snap.items() if k not in hidden}
+
+def share_prefs_from_row(row: Optional[Dict[str, Any]]) -> Dict[str, bool]:
+    if not row:
+        return dict(DEFAULT_SHARE_PREFS)
+    return {k: bool(row.get(f"include_{k}", v)) for k, v in DEFAULT_SHARE_PREFS.items()}
+
+def _fetch_share_prefs(user_id: str) -> Dict[str, bool]:
+    res = sb_execute(SUPABASE.table("cc_shares").select("include_steps,include_lessons,include_meals").eq("user_id", user_id).limit(1))
+    return share_prefs_from_row(res.data[0] if res.data else None)
+
+def week_log_add(kind: str, n: int = 1):
+    wl = st.session_state.week_log
+    day = wl.setdefault(dt.date.today().isoformat(), {})
+    day[kind] = day.get(kind, 0) + n
+    while len(wl) > CARE_WINDOW_DAYS:
+        wl.pop(min(wl))
+
+def week_totals(kind: str, days: int = CARE_WINDOW_DAYS) -> int:
+    wl, today = st.session_state.week_log, dt.date.today()
+    return sum(wl.get((today - dt.timedelta(days=i)).isoformat(), {}).get(kind, 0) for i in range(days))
+
+def care_snapshot() -> Dict[str, Any]:
+    # The full summary (the patient's own footer uses it); publishing filters it by share_prefs
+    d = st.session_state
+    d.step_log.set_goal(d.goal)
+    diet_today, diet_week = ledger(), ledger_rollup(CARE_WINDOW_DAYS)
+    return {
+        "name": d.name, "xp": d.xp, "goal": d.goal, "steps_today": d.step_log.today(),
+        "steps_avg_7d": d.step_log.avg(7), "steps_avg_30d": d.step_log.avg(30), "step_streak": d.step_log.streak(),
+        "lessons_7d": week_totals("lessons"), "quiz_streak": d.quiz_streak,
+        "meals_today": diet_today["meals"], "sodium_mg": diet_today["sodium_mg"], "added_sugar_g": diet_today["added_sugar_g"],
+        "sodium_budget_mg": d.sodium_budget_mg, "sugar_budget_g": d.sugar_budget_g, "meals_7d": diet_week["meals"],
+        "day": dt.date.today().isoformat(),
+    }
+
+def _load_care_snapshot_remote(user_id: str) -> Optional[Dict[str, Any]]:
+    if not SUPABASE:
         return None
-    return f"https://api.mapbox.com/styles/v1/mapbox/streets-v11/static/pin-s+f30({lon},{lat})/{lon},{lat},14/600x300?access_token={MAPBOX_TOKEN}"
+    res = sb_execute(SUPABASE.table("cc_care_snapshots").select("snapshot").eq("user_id", user_id).limit(1))
+    # Re-filtered here too, for rows published before the preferences were applied or last changed
+    return filter_care_snapshot(json.loads(res.data[0]["snapshot"]), _fetch_share_prefs(user_id)) if res.data else None
+
+@st.cache_resource
+def get_care_snapshots() -> TTLCache:
+    # Patients publish into it directly; caregivers polling one patient share a single entry
+    return TTLCache(CARE_SNAPSHOT_MAX, get_background_pool())
+
+def load_care_snapshot(user_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        return get_care_snapshots().get_or_load(user_id, lambda: _load_care_snapshot_remote(user_id), ttl=CARE_SNAPSHOT_TTL_S)
+    except Exception as e:
+        log.warning("Care snapshot load failed for %s: %s", user_id, e)
+        return None
+
+def publish_care_snapshot() -> Optional[Dict[str, Any]]:
+    # Returns the cc_care_snapshots row to write, or None when nothing a caregiver sees has changed
+    snap = filter_care_snapshot(care_snapshot(), st.session_state.share_prefs)  # only what the patient shares
+    if st.session_state.get("_care_published") == snap:
+        return None
+    st.session_state._care_published = snap
+    user_id = get_user_id()
+    get_care_snapshots().put(user_id, snap, CARE_SNAPSHOT_TTL_S)
+    return {"user_id": user_id, "snapshot": json.dumps(snap), "updated_at": dt.datetime.now(dt.timezone.utc).isoformat()}
 
 # ---------------------------
 # Init state
@@ -472,8 +2538,8 @@ def _init_state():
     d.setdefault("name", "Alex")
     d.setdefault("caregiver", False)
     d.setdefault("strava", False)
-    d.setdefault("steps", 4200)
     d.setdefault("goal", 8000)
+    d.setdefault("step_log", StepLedger(goal=d.goal))  # daily step counts; today's is step_log.today()
     d.setdefault("conditions", ["hypertension", "diabetes"])
     d.setdefault("flags", ["DASH Diet", "Low Sugar", "High Fiber"])
     d.setdefault("zip", "01610")
@@ -484,33 +2550,29 @@ def _init_state():
     d.setdefault("sodium_budget_mg", 1500)
     d.setdefault("sugar_budget_g", 25)
     d.setdefault("meals_today", [])
+    d.setdefault("nutrition", {"today": _ledger_day(dt.date.today().isoformat()), "history": {}})
+    d.setdefault("week_log", {})  # last 7 days of {"lessons"} counters behind the Care Circle snapshot
+    d.setdefault("share_prefs", dict(DEFAULT_SHARE_PREFS))  # saved Care Circle choices; filters the snapshot
     d.setdefault("cook_recipe_id", None)
     d.setdefault("cook_step_idx", 0)
     # Manage
-    d.setdefault("vitals", [])  # list of dicts: {"ts": "...", "bp_sys": int, "bp_dia": int, "glucose": int, "weight": float}
-    d.setdefault("meds", [])    # list of dicts: {"id": str, "name": str, "dose": str, "time": "HH:MM", "taken_dates": set([...])}
+    d.setdefault("vitals", VitalsStore())  # columnar; records are {"ts": "...", "bp_sys": int, "bp_dia": int, "glucose": int, "weight": float}
+    d.setdefault("meds", [])    # list of dicts: {"id": str, "name": str, "dose": str, "time": "HH:MM[, HH:MM…]", "adherence": AdherenceCalendar}
+    d.setdefault("tz", DEFAULT_TZ)  # IANA zone the dose times are in
     # N-of-1
     d.setdefault("n1", {})      # {"phaseA","phaseB","metric","start","days","sequence":[...], "obs":[{"date","phase","value"}], "active":bool}
     # Community
     d.setdefault("events", [])  # list of events user-added
 
-_init_state()
-if SUPABASE:
-    supabase_load_state()
+# Widgets that own app state but live inside a section. With lazy navigation a section that isn't
+# rendered would have its widget state garbage-collected; re-assigning detaches it from the widget.
+SECTION_WIDGET_KEYS = ["sodium_budget_mg", "sugar_budget_g", "goal", "strava", "zip", "tz",
+                       "ctx_weather_rain", "ctx_aqi_high", "recipe_sort", "recipe_page_size", "recipe_page"]
 
-# Styling for Accessibility (Simple UI)
-if st.session_state.simple:
-    st.markdown(
-        """
-        <style>
-        html, body, [class*="css"]  { font-size: 18px !important; }
-        .stButton>button { padding: 0.9rem 1.1rem; font-size: 1.05rem; }
-        .stRadio>div>label { padding: 0.2rem 0; }
-        .st-emotion-cache-1dp5vir { filter: contrast(1.15); }
-        </style>
-        """,
-        unsafe_allow_html=True,
-    )
+def _keep_widget_state():
+    for k in SECTION_WIDGET_KEYS:
+        if k in st.session_state:
+            st.session_state[k] = st.session_state[k]
 
 # Helpers
 def level_from_xp(xp: int) -> int:
@@ -520,13 +2582,87 @@ def add_xp(n: int):
     if SUPABASE:
         supabase_upsert_state()
 
+def cc_fragment(fn):
+    # Independently rerunnable widget group: a click inside reruns only this function, not the page.
+    # A fragment rerun never reaches the end-of-script flush, so flush here; the inline XP line stands
+    # in for the page header, and a level-up escalates to a full rerun so the header catches up.
+    @functools.wraps(fn)
+    def body(*args, **kwargs):
+        start_latency_budget()
+        level_before = level_from_xp(st.session_state.xp)
+        try:
+            fn(*args, **kwargs)
+        finally:
+            supabase_flush_state()
+        st.caption(f"{t('level')} {level_from_xp(st.session_state.xp)} • {st.session_state.xp} {t('xp')}")
+        if level_from_xp(st.session_state.xp) != level_before:
+            st.rerun()
+    return st.fragment(body)
+
 # Care Circle query params
 params = st.query_params
 is_care_view = params.get("care", ["0"])[0] == "1"
+share_user = params.get("u") or ""
 share_include_steps = params.get("s", ["1"])[0] == "1"
 share_include_lessons = params.get("l", ["1"])[0] == "1"
 share_include_meals = params.get("m", ["0"])[0] == "1"
 
+def care_view_ui():
+    # Read-only caregiver page: one cached snapshot read, no session state or patient load
+    st.title(t("title"))
+    snap = load_care_snapshot(share_user) if share_user else None
+    if not snap:
+        st.info("Care Circle View — no summary has been shared from this link yet.")
+        return
+    c1, c2 = st.columns([4,2])
+    c1.info(f"Care Circle View — read-only summary for {snap['name']}")
+    c2.metric(t("level"), level_from_xp(snap["xp"]))
+    st.header("Shared Weekly Summary")
+    if share_include_steps and "steps_today" in snap:
+        st.subheader("Activity")
+        pct = min(100, round(100*snap["steps_today"]/max(1, snap["goal"])))
+        st.progress(pct/100, text=f"{snap['steps_today']:,} / {snap['goal']:,} steps today")
+        st.caption(f"7-day avg steps: {snap['steps_avg_7d']:,} • 30-day avg: {snap.get('steps_avg_30d', 0):,} • "
+                   f"goal streak: {snap.get('step_streak', 0)} d")
+    if share_include_lessons and "lessons_7d" in snap:
+        st.subheader("Education")
+        st.write(f"Lessons completed this week: {snap['lessons_7d']}")
+        st.write("Quiz streak:", snap["quiz_streak"])
+    if share_include_meals and "meals_today" in snap:
+        st.subheader("Diet")
+        st.write(f"Meals logged today: {snap['meals_today']} • this week: {snap['meals_7d']}")
+        st.write(f"Sodium used: {snap['sodium_mg']} mg / {snap['sodium_budget_mg']} mg")
+        st.write(f"Added sugar: {snap['added_sugar_g']} g / {snap['sugar_budget_g']} g")
+    st.caption(f"As of {snap['day']}")
+
+if is_care_view:
+    care_view_ui()
+    st.stop()
+
+start_latency_budget()
+_init_state()
+_keep_widget_state()
+if SUPABASE and not st.session_state.get("_loaded"):  # once per session: saves are write-behind, so a
+    supabase_load_state()                                # reload could read a row the worker hasn't written yet
+if not st.session_state.get("_reminders_synced"):  # once per session (lazy loads sync on arrival); edits re-sync themselves
+    st.session_state._reminders_synced = True
+    sync_reminders()
+prefetch_live_context()
+
+# Styling for Accessibility (Simple UI)
+if st.session_state.simple:
+    st.markdown(
+        """
+        <style>
+        html, body, [class*="css"]  { font-size: 18px !important; }
+        .stButton>button { padding: 0.9rem 1.1rem; font-size: 1.05rem; }
+        .stRadio>div>label { padding: 0.2rem 0; }
+        .st-emotion-cache-1dp5vir { filter: contrast(1.15); }
+        </style>
+        """,
+        unsafe_allow_html=True,
+    )
+
 # Sidebar — Accessibility & Culture & Integrations
 with st.sidebar:
     st.toggle(T[st.session_state.get("lang","en")]["simple"], key="simple")
@@ -536,13 +2672,19 @@ with st.sidebar:
                  key="culture")
     if SUPABASE:
         st.success("Supabase: connected")
+        if get_persist_worker().last_error:
+            st.warning(f"Last save failed: {get_persist_worker().last_error}")
     else:
         st.info("Supabase: off (session-only)")
-    if OPENWEATHER_API_KEY:
+    if OPENWEATHER_API_KEY and not breaker(OPENWEATHER_HOST).available():
+        st.warning("OpenWeather: unavailable — demo toggles")
+    elif OPENWEATHER_API_KEY:
         st.success("OpenWeather: on")
     else:
         st.info("OpenWeather: demo toggles")
-    if MAPBOX_TOKEN:
+    if MAPBOX_TOKEN and not breaker(MAPBOX_HOST).available():
+        st.warning("Mapbox: unavailable")
+    elif MAPBOX_TOKEN:
         st.success("Mapbox: on")
     else:
         st.info("Mapbox: off")
@@ -553,47 +2695,48 @@ with col1:
     st.title(t("title"))
     st.caption(t("tag"))
 with col2:
-    if not is_care_view:
-        st.toggle(t("caregiver"), key="caregiver")
-        st.text_input(t("name"), key="name")
-    else:
-        st.info("Care Circle View — read-only summary")
+    st.toggle(t("caregiver"), key="caregiver")
+    st.text_input(t("name"), key="name")
 with col3:
     st.metric(t("level"), level_from_xp(st.session_state.xp))
     st.metric(t("xp"), st.session_state.xp)
+    st.caption(f"👣 {st.session_state.step_log.today():,} steps today • 7-day avg {st.session_state.step_log.avg(7):,}")
 
 st.divider()
 
-# Care Circle read-only
-if is_care_view:
-    st.header("Shared Weekly Summary")
-    if share_include_steps:
-        st.subheader("Activity")
-        pct = min(100, round(100*st.session_state.steps/max(1, st.session_state.goal)))
-        st.progress(pct/100, text=f"{st.session_state.steps:,} / {st.session_state.goal:,} steps today")
-        st.caption("7-day avg steps: 7,350 (demo)")
-    if share_include_lessons:
-        st.subheader("Education")
-        st.write("Lessons completed this week: 5 (demo)")
-        st.write("Quiz streak:", st.session_state.quiz_streak)
-    if share_include_meals:
-        st.subheader("Diet")
-        total_sodium = sum(r["sodium_mg"] for r in [x for x in RECIPES if x["id"] in st.session_state.meals_today]) if st.session_state.meals_today else 0
-        total_sugar  = sum(r["added_sugar_g"] for r in [x for x in RECIPES if x["id"] in st.session_state.meals_today]) if st.session_state.meals_today else 0
-        st.write(f"Meals logged today: {len(st.session_state.meals_today)}")
-        st.write(f"Sodium used: {total_sodium} mg / {st.session_state.sodium_budget_mg} mg")
-        st.write(f"Added sugar: {total_sugar} g / {st.session_state.sugar_budget_g} g")
-    st.stop()
-
-# Tabs
-tab_diet, tab_edu, tab_ex, tab_manage, tab_exper, tab_comm, tab_resources, tab_pro, tab_share = st.tabs(
-    [t("diet"), t("edu"), t("ex"), t("manage"), t("experiments"), t("community"), t("res"), t("pro"), t("share")]
-)
-
 # ---------------------------
 # Diet tab (with cultural filtering kept simple)
 # ---------------------------
-with tab_diet:
+@cc_fragment
+def coach_cook_ui():
+    rec = CATALOG.get(st.session_state.cook_recipe_id) if st.session_state.cook_recipe_id else None
+    if rec:
+        st.markdown(f"### {t('coach_cook')}: **{rec['title']}**")
+        steps = rec.get("cook", [])
+        idx = st.session_state.cook_step_idx
+        if idx < len(steps):
+            title, secs, note = steps[idx]
+            st.write(f"**Step {idx+1} of {len(steps)} — {title}**")
+            st.info(note)
+            colA, colB, colC = st.columns([1,1,2])
+            if colA.button(t("step_done"), key=f"cook_step_{idx}"):
+                add_xp(2)
+                st.session_state.cook_step_idx += 1
+                if SUPABASE:
+                    supabase_upsert_state()
+                st.rerun(scope="fragment")
+            if colB.button(t("cancel"), key="cook_cancel"):
+                st.session_state.cook_recipe_id = None
+                st.session_state.cook_step_idx = 0
+            with colC:
+                st.caption("Tip: Use acids, herbs, and spices to replace salt.")
+        else:
+            st.success(t("cook_done"))
+            add_xp(10)
+            st.session_state.cook_recipe_id = None
+            st.session_state.cook_step_idx = 0
+
+def diet_ui():
     st.subheader("Smart Meal Plans & Cookbooks")
     colA, colB = st.columns(2)
     with colA:
@@ -615,19 +2758,19 @@ with tab_diet:
         st.number_input(t("sugar"), key="sugar_budget_g", min_value=0, max_value=100, step=1)
     with b3:
         if st.button(t("endday"), key="endday_btn"):
-            total_sodium = sum(r["sodium_mg"] for r in [x for x in RECIPES if x["id"] in st.session_state.meals_today]) if st.session_state.meals_today else 0
-            total_sugar  = sum(r["added_sugar_g"] for r in [x for x in RECIPES if x["id"] in st.session_state.meals_today]) if st.session_state.meals_today else 0
-            ok_sodium = total_sodium <= st.session_state.sodium_budget_mg
-            ok_sugar = total_sugar <= st.session_state.sugar_budget_g
+            tot = ledger()
+            ok_sodium = tot["sodium_mg"] <= st.session_state.sodium_budget_mg
+            ok_sugar = tot["added_sugar_g"] <= st.session_state.sugar_budget_g
             if ok_sodium and ok_sugar:
                 add_xp(30)
                 st.success(t("underbudgets"))
             else:
                 st.info(t("overbudgets"))
-            st.session_state.meals_today = []
+            ledger_close_day()
+            supabase_upsert_state()
 
-    total_sodium = sum(r["sodium_mg"] for r in [x for x in RECIPES if x["id"] in st.session_state.meals_today]) if st.session_state.meals_today else 0
-    total_sugar  = sum(r["added_sugar_g"] for r in [x for x in RECIPES if x["id"] in st.session_state.meals_today]) if st.session_state.meals_today else 0
+    tot = ledger()
+    total_sodium, total_sugar = tot["sodium_mg"], tot["added_sugar_g"]
 
     pb1, pb2 = st.columns(2)
     with pb1:
@@ -636,24 +2779,31 @@ with tab_diet:
     with pb2:
         su_pct = min(1.0, total_sugar / max(1, st.session_state.sugar_budget_g))
         st.progress(su_pct, text=f"Added sugar: {total_sugar} / {st.session_state.sugar_budget_g} g")
-
-    # filter by conditions/flags and cultural lens
-    cond_set = set(st.session_state.conditions)
-    flag_set = set(st.session_state.flags)
-    cul = st.session_state.culture
-    cul_tags = set(CULTURE_TAGS.get(cul, []))
-    filtered = []
-    for r in RECIPES:
-        cond_match = cond_set.intersection(set(r["tags"]))
-        flag_match = flag_set.intersection(set(r["tags"]))
-        culture_match = True if cul == "global" else bool(cul_tags.intersection(set(r.get("culture", []))))
-        if (cond_match or flag_match) and culture_match:
-            filtered.append(r)
-
-    st.write(f"**{t('recipes')}:** {len(filtered)}")
+    week = ledger_rollup(7)
+    st.caption(f"Last 7 days: {week['meals']} meals • avg {week['sodium_mg'] // 7} mg sodium/day • avg {week['added_sugar_g'] // 7} g added sugar/day")
+
+    # filter by conditions/flags and cultural lens (posting-list lookup, cached per selection)
+    cs, cz, cp = st.columns([2,1,1])
+    sort = cs.selectbox(t("sort_by"), list(RECIPE_SORTS), format_func=lambda k: t(f"sort_{k}"), key="recipe_sort")
+    page_sizes = sorted({5, 10, 20, 50, RECIPE_PAGE_SIZE})
+    page_size = cz.selectbox(t("page_size"), page_sizes, index=page_sizes.index(RECIPE_PAGE_SIZE), key="recipe_page_size")
+    ids = CATALOG.index.query(st.session_state.conditions, st.session_state.flags, st.session_state.culture, sort)
+    total = len(ids)
+    pages = max(1, -(-total // page_size))
+    query_key = (tuple(st.session_state.conditions), tuple(st.session_state.flags), st.session_state.culture, sort, page_size)
+    if st.session_state.get("_recipe_query") != query_key or st.session_state.get("recipe_page", 1) > pages:
+        st.session_state._recipe_query = query_key
+        st.session_state.recipe_page = 1
+    page = cp.number_input(t("page"), min_value=1, max_value=pages, step=1, key="recipe_page")
+    first = (page - 1) * page_size
+    # Only the visible page is decoded from the catalog and turned into widgets
+    filtered = [r for r in (CATALOG.get(i) for i in ids[first:first + page_size]) if r]
+
+    st.write(f"**{t('recipes')}:** {total}" + (f" — {first + 1}–{first + len(filtered)}" if total > page_size else ""))
 
     def add_meal(r):
         st.session_state.meals_today.append(r["id"])
+        ledger_add(r["id"])
         add_xp(15)
         st.success(f"Added! (+15 XP) Sodium {r['sodium_mg']} mg • Sugar {r['added_sugar_g']} g")
 
@@ -678,31 +2828,7 @@ with tab_diet:
                 st.button(t("save"), key=f"save_{r['id']}", use_container_width=True)
 
     if st.session_state.cook_recipe_id:
-        rec = next((x for x in RECIPES if x["id"]==st.session_state.cook_recipe_id), None)
-        st.markdown(f"### {t('coach_cook')}: **{rec['title']}**")
-        steps = rec.get("cook", [])
-        idx = st.session_state.cook_step_idx
-        if idx < len(steps):
-            title, secs, note = steps[idx]
-            st.write(f"**Step {idx+1} of {len(steps)} — {title}**")
-            st.info(note)
-            colA, colB, colC = st.columns([1,1,2])
-            if colA.button(t("step_done"), key=f"cook_step_{idx}"):
-                add_xp(2)
-                st.session_state.cook_step_idx += 1
-                if SUPABASE:
-                    supabase_upsert_state()
-                st.rerun()
-            if colB.button(t("cancel"), key="cook_cancel"):
-                st.session_state.cook_recipe_id = None
-                st.session_state.cook_step_idx = 0
-            with colC:
-                st.caption("Tip: Use acids, herbs, and spices to replace salt.")
-        else:
-            st.success(t("cook_done"))
-            add_xp(10)
-            st.session_state.cook_recipe_id = None
-            st.session_state.cook_step_idx = 0
+        coach_cook_ui()
 
 # ---------------------------
 # Education tab (same as before)
@@ -712,7 +2838,8 @@ QUIZ_BANK = [
     {"id":"q2","condition":"diabetes","prompt":"For type 2 diabetes, what helps stabilize post-meal glucose most?","options":["Skipping breakfast","Balancing protein/fiber with carbs and portion awareness","Only eating fruit","Eliminating all carbs"],"answer":1,"fact":"Protein and fiber slow glucose absorption. Portion and carb quality matter more than total avoidance."},
 ]
 
-with tab_edu:
+@cc_fragment
+def quiz_ui():
     st.subheader(t("quiz"))
     q = QUIZ_BANK[st.session_state.quiz_idx % len(QUIZ_BANK)]
     st.caption(f"Topic: **{q['condition'].capitalize()}**")
@@ -725,6 +2852,7 @@ with tab_edu:
                 st.warning("Pick an option to submit.")
             else:
                 correct = q["options"].index(choice) == q["answer"]
+                week_log_add("lessons")
                 if correct:
                     add_xp(20)
                     st.success("Correct! +20 XP")
@@ -733,17 +2861,20 @@ with tab_edu:
                     add_xp(5)
                     st.info("Good try — +5 XP for learning.")
                     st.session_state.quiz_streak = 0
-                if st.session_state.quiz_streak >= 5:
-                    st.session_state.boss_unlocked = True
                 if SUPABASE:
                     supabase_upsert_state()
+                if st.session_state.quiz_streak >= 5 and not st.session_state.boss_unlocked:
+                    st.session_state.boss_unlocked = True
+                    st.rerun()  # the Boss Level section lives outside this fragment
     with col2:
         if st.button(t("next"), key=f"quiz_next_{st.session_state.quiz_idx}"):
             st.session_state.quiz_idx += 1
-            st.rerun()
+            st.rerun(scope="fragment")
     with col3:
         st.metric(t("streak"), st.session_state.quiz_streak)
 
+def edu_ui():
+    quiz_ui()
     st.divider()
     st.subheader(t("boss"))
     if st.session_state.boss_unlocked and not st.session_state.boss_cleared:
@@ -776,30 +2907,49 @@ with tab_edu:
 # ---------------------------
 # Exercise tab (with GeoChallenges 2.0)
 # ---------------------------
-GEO_PARKS = {
-  "01610": ["Elm Park Loop", "Institute Park Track", "Green Hill Park"],
-  "02139": ["Charles River Path", "Dana Park Loop", "LM Fields Track"],
-  "10001": ["High Line North Loop", "Chelsea Park Track", "Hudson Yards Walk"],
+GEO_PARKS = {  # seed parks: (name, lat, lon), grouped by the ZIP they were picked for
+  "01610": [("Elm Park Loop", 42.2733, -71.8228), ("Institute Park Track", 42.2750, -71.8070), ("Green Hill Park", 42.2903, -71.7808)],
+  "02139": [("Charles River Path", 42.3573, -71.0929), ("Dana Park Loop", 42.3625, -71.1045), ("LM Fields Track", 42.3890, -71.1250)],
+  "10001": [("High Line North Loop", 40.7536, -74.0050), ("Chelsea Park Track", 40.7494, -74.0001), ("Hudson Yards Walk", 40.7538, -74.0020)],
 }
+DEFAULT_PARKS = ["Community Park Loop", "City Track", "Waterfront Path"]
 
-with tab_ex:
+@cc_fragment
+def activity_ui():
     st.subheader(t("activity"))
+    steps = st.session_state.step_log
+    steps.set_goal(st.session_state.goal)
     col1, col2, col3 = st.columns([2,1,1])
     with col1:
-        pct = min(100, round(100*st.session_state.steps/max(1, st.session_state.goal)))
-        st.progress(pct/100, text=f"{st.session_state.steps:,} / {st.session_state.goal:,} steps ({pct}%)")
+        pct = min(100, round(100*steps.today()/max(1, st.session_state.goal)))
+        st.progress(pct/100, text=f"{steps.today():,} / {st.session_state.goal:,} steps ({pct}%)")
+        st.caption(f"7-day avg {steps.avg(7):,} • 30-day avg {steps.avg(30):,} • goal streak {steps.streak()} d")
     with col2:
         if st.button(t("plus_steps"), key="plus_steps_btn"):
-            st.session_state.steps += 500
+            steps.add(500)
             if SUPABASE:
                 supabase_upsert_state()
+            st.rerun(scope="fragment")
     with col3:
         if st.button(t("log_walk"), key="log_walk_btn"):
             add_xp(8)
             st.success("Walk logged! +8 XP")
 
+def exercise_ui():
+    activity_ui()
     st.number_input(t("goal"), value=st.session_state.goal, step=500, key="goal")
     st.toggle(t("strava"), key="strava")
+    if st.session_state.strava:
+        up = st.file_uploader("Daily steps export (CSV / JSON: date, steps)", type=["csv", "json", "jsonl"], key="steps_import")
+        if up is not None and st.button("Import steps", key="steps_import_btn"):
+            res = import_steps(up, "csv" if up.name.lower().endswith(".csv") else "json", st.session_state.step_log)
+            if res["changed"]:
+                supabase_upsert_state()
+            st.success(f"{res['days']:,} days read • {res['changed']:,} updated • {res['rejected']:,} rows rejected")
+            if res["reasons"]:
+                st.caption(" • ".join(f"{r}: {n}" for r, n in res["reasons"].items()))
+    st.bar_chart({"day": [d for d, _ in st.session_state.step_log.series(30)],
+                  "steps": [n for _, n in st.session_state.step_log.series(30)]}, x="day", y="steps")
 
     st.divider()
     st.subheader(t("gc2"))
@@ -807,12 +2957,19 @@ with tab_ex:
     ctx_col, map_col = st.columns([1,1])
     lat = lon = None
     loc_name = None
-    if OPENWEATHER_API_KEY:
+    ctx = live_context()
+    geo = ctx.geo if ctx.done() else geocode_zip(st.session_state.zip)  # the geocode is local for bundled ZIPs
+    if geo and geo.get("lat"):
+        lat, lon, loc_name = geo["lat"], geo["lon"], geo.get("name", "")
+    live = OPENWEATHER_API_KEY and breaker(OPENWEATHER_HOST).available()
+    if live and ctx.done() and lat is not None and not (ctx.weather or ctx.aqi):
+        live = False  # nothing came back (yet): the demo toggles until a retry lands
+    if live:
         st.caption(t("live_ctx"))
-        geo = geocode_zip(st.session_state.zip)
-        if geo and geo.get("lat"):
-            lat, lon, loc_name = geo["lat"], geo["lon"], geo.get("name", "")
-            weather, aqi = fetch_weather_aqi(lat, lon)
+        if not ctx.done():
+            st.caption(t("ctx_loading"))
+        if lat is not None:
+            weather, aqi = ctx.weather, ctx.aqi
             if weather:
                 w_main = weather.get("weather", [{}])[0].get("main", "")
                 w_temp = weather.get("main", {}).get("temp")
@@ -839,11 +2996,12 @@ with tab_ex:
 
     st.text_input(t("zip"), key="zip")
     if MAPBOX_TOKEN and lat and lon:
-        url = mapbox_static(lat, lon)
-        if url:
-            map_col.image(url, caption=f"{loc_name or 'Location'}")
+        img = mapbox_static(lat, lon)
+        if img:
+            map_col.image(img, caption=f"{loc_name or 'Location'}")
 
-    parks = GEO_PARKS.get(st.session_state.zip, ["Community Park Loop", "City Track", "Waterfront Path"])
+    parks = [p["name"] for p in get_community_store().parks_near(lat, lon, PARK_RADIUS_MI)] if lat is not None else []
+    parks = parks[:5] or DEFAULT_PARKS
 
     if suggest_indoor:
         with st.container(border=True):
@@ -869,68 +3027,147 @@ with tab_ex:
 def vitals_capture_ui():
     st.subheader(t("vitals"))
     c1, c2, c3, c4 = st.columns([2,2,2,1])
-    bp_sys = c1.number_input(t("bp")+" — systolic", min_value=70, max_value=240, value=120, step=1, key="bp_sys")
-    bp_dia = c2.number_input(t("bp")+" — diastolic", min_value=40, max_value=140, value=80, step=1, key="bp_dia")
-    glu = c3.number_input(t("glucose"), min_value=40, max_value=500, value=100, step=1, key="glu")
-    wt = c4.number_input(t("weight"), min_value=60.0, max_value=600.0, value=180.0, step=0.5, key="wt")
+    (sys_lo, sys_hi), (dia_lo, dia_hi) = VITAL_LIMITS["bp_sys"], VITAL_LIMITS["bp_dia"]
+    (glu_lo, glu_hi), (wt_lo, wt_hi) = VITAL_LIMITS["glucose"], VITAL_LIMITS["weight"]
+    bp_sys = c1.number_input(t("bp")+" — systolic", min_value=sys_lo, max_value=sys_hi, value=120, step=1, key="bp_sys")
+    bp_dia = c2.number_input(t("bp")+" — diastolic", min_value=dia_lo, max_value=dia_hi, value=80, step=1, key="bp_dia")
+    glu = c3.number_input(t("glucose"), min_value=glu_lo, max_value=glu_hi, value=100, step=1, key="glu")
+    wt = c4.number_input(t("weight"), min_value=wt_lo, max_value=wt_hi, value=180.0, step=0.5, key="wt")
     if st.button(t("capture"), key="capture_vitals"):
-        st.session_state.vitals.append({
+        reading = {
             "ts": dt.datetime.now().isoformat(timespec="seconds"),
             "bp_sys": int(bp_sys), "bp_dia": int(bp_dia),
             "glucose": int(glu), "weight": float(wt),
-        })
+        }
+        st.session_state.vitals.append(reading)
+        persist_append("cc_vitals", reading)
         add_xp(6)
         st.success("Vitals captured (+6 XP)")
-        if SUPABASE:
-            supabase_upsert_state()
-    # Simple trend flags
-    if st.session_state.vitals:
-        last = st.session_state.vitals[-1]
-        alerts = []
-        if last["bp_sys"] >= 140 or last["bp_dia"] >= 90:
-            alerts.append("Elevated blood pressure")
-        if last["glucose"] >= 180:
-            alerts.append("Elevated glucose")
-        if alerts:
-            st.warning(" • ".join(alerts))
+    with st.expander("Import from a home device (CSV / JSON)"):
+        st.caption("Columns: timestamp, systolic, diastolic, glucose, weight — any subset of measurements per row.")
+        up = st.file_uploader("Device export", type=["csv", "json", "jsonl"], key="vitals_import")
+        if up is not None and st.button("Import readings", key="vitals_import_btn"):
+            bar = st.progress(0.0, text="Importing…")
+            size = max(1, up.size)
+            res = import_vitals(up, "csv" if up.name.lower().endswith(".csv") else "json", st.session_state.vitals,
+                                on_chunk=lambda s: bar.progress(min(1.0, up.tell() / size), text=f"{s['added']:,} readings added"))
+            bar.progress(1.0, text="Done")
+            st.success(f"Imported {res['added']:,} readings • {res['duplicates']:,} duplicates skipped • {res['rejected']:,} rejected")
+            if res["reasons"]:
+                st.caption(" • ".join(f"{r}: {n}" for r, n in res["reasons"].items()))
+    store = st.session_state.vitals
+    if not len(store):
+        return
+    # Trend flags: the latest reading plus sustained elevation over the last 7 days
+    last = store.last()
+    alerts = []
+    if (last["bp_sys"] or 0) >= 140 or (last["bp_dia"] or 0) >= 90:
+        alerts.append("Elevated blood pressure")
+    if (last["glucose"] or 0) >= 180:
+        alerts.append("Elevated glucose")
+    if store.count("bp_sys", 7) >= 3 and (store.mean("bp_sys", 7) >= 135 or store.mean("bp_dia", 7) >= 85):
+        alerts.append(f"Sustained high BP — 7-day avg {store.mean('bp_sys', 7):.0f}/{store.mean('bp_dia', 7):.0f}")
+    if store.count("glucose", 7) >= 3 and store.mean("glucose", 7) >= 154:
+        alerts.append(f"Sustained high glucose — 7-day avg {store.mean('glucose', 7):.0f} mg/dL")
+    if store.count("weight", 7) >= 3 and store.slope("weight", 7) * 7 >= 5:
+        alerts.append("Rapid weight gain (≥5 lb/week)")
+    if alerts:
+        st.warning(" • ".join(alerts))
+    # Rolling averages and 30-day trend per measure
+    rows = []
+    for f, label in VITAL_LABELS.items():
+        row = {"measure": label}
+        for days in TREND_WINDOWS_DAYS:
+            m = store.mean(f, days)
+            row[f"{days}d avg"] = None if np.isnan(m) else round(m, 1)
+        wk = store.slope(f, 30) * 7
+        row["30d trend / wk"] = None if np.isnan(wk) else round(wk, 1)
+        rows.append(row)
+    st.dataframe(rows, use_container_width=True, hide_index=True)
     # Show recent vitals
-    if st.session_state.vitals:
-        st.dataframe(st.session_state.vitals[::-1][:12], use_container_width=True)
+    st.dataframe(store.tail(12), use_container_width=True)
+
+def vitals_chart_ui():
+    store = st.session_state.vitals
+    if len(store) < 2:
+        return
+    c1, c2, c3 = st.columns(3)
+    field = c1.selectbox("Series", VITAL_FIELDS, format_func=VITAL_LABELS.get, key="chart_field")
+    days = c2.selectbox("Range", [7, 30, 90, 365, 0], index=2, format_func=lambda d: f"{d} days" if d else "All", key="chart_range")
+    points = c3.select_slider("Resolution (points)", options=sorted({100, 200, 400, 800, CHART_POINTS}), value=CHART_POINTS, key="chart_points")
+    x, y = store.downsample(field, days, points)
+    if len(x) < 2:
+        st.caption("Not enough readings in this range.")
+        return
+    label = VITAL_LABELS[field]
+    st.line_chart({"time": [dt.datetime.fromtimestamp(int(v)) for v in x], label: y}, x="time", y=label)
 
 def meds_ui():
     st.subheader(t("meds"))
     c1, c2, c3 = st.columns([2,1,1])
     mname = c1.text_input(t("med_name"), key="med_name")
     mdose = c2.text_input(t("dose"), key="med_dose")
-    mtime = c3.text_input(t("schedule"), placeholder="08:00", key="med_time")
+    mtime = c3.text_input(t("schedule"), placeholder="08:00, 20:00", key="med_time")
     if st.button(t("add_med"), key="add_med_btn"):
-        if mname and mtime:
-            st.session_state.meds.append({"id": str(uuid.uuid4()), "name": mname, "dose": mdose, "time": mtime, "taken_dates": []})
+        try:
+            times = parse_dose_times(mtime)
+        except ValueError:
+            times = None
+        if mname and times:
+            st.session_state.meds.append({"id": str(uuid.uuid4()), "name": mname, "dose": mdose, "time": ", ".join(times),
+                                          "adherence": AdherenceCalendar(dt.date.today())})
+            sync_reminders()
             st.success("Medication added")
             if SUPABASE: supabase_upsert_state()
+        elif mname and times is None:
+            st.warning("Times must be 24h HH:MM, comma-separated (e.g. 08:00, 20:00).")
         else:
             st.warning("Name and time are required.")
+    if st.session_state.tz not in REMINDER_TZS:
+        REMINDER_TZS.append(st.session_state.tz)
+    st.selectbox(t("tz"), REMINDER_TZS, key="tz", on_change=_tz_changed)
+    med_checklist_ui()
+
+def _tz_changed():
+    sync_reminders()
+    supabase_upsert_state()
+
+@cc_fragment
+def med_checklist_ui():
     # Today’s checklist
     st.markdown("**Today**")
-    today = dt.date.today().isoformat()
-    for i, m in enumerate(st.session_state.meds):
+    sched, user_id, tz = get_reminder_scheduler(), get_user_id(), _tz(st.session_state.tz)
+    today = dt.datetime.now(tz).date()  # the user's date, the same one the reminder ack uses
+    for i, m in enumerate(list(st.session_state.meds)):
+        cal = med_calendar(m)
         with st.container(border=True):
-            colA, colB, colC, colD = st.columns([2,1,1,1])
+            colA, colB, colC, colD, colE = st.columns([2,1,1,1,1])
             colA.write(f"**{m['name']}** — {m['dose'] or ''}")
             colB.write(m["time"])
-            taken = today in m["taken_dates"]
+            nxt = sched.next_due(user_id, m["id"])
+            if nxt:
+                colB.caption("next " + dt.datetime.fromtimestamp(nxt, tz).strftime("%a %H:%M"))
             if colC.button(t("taken")+" ✅", key=f"med_taken_{m['id']}"):
-                if today not in m["taken_dates"]:
-                    m["taken_dates"].append(today)
+                sched.ack(user_id, m["id"], today)
+                if cal.mark(today):
+                    persist_append("cc_med_doses", {"med_id": m["id"], "date": today.isoformat(), "taken": True, "ts": dt.datetime.now().isoformat()})
                     add_xp(4)
-                    if SUPABASE: supabase_upsert_state()
             if colD.button(t("missed")+" ⚠️", key=f"med_missed_{m['id']}"):
-                if today in m["taken_dates"]:
-                    m["taken_dates"].remove(today)
-                    if SUPABASE: supabase_upsert_state()
+                sched.unack(user_id, m["id"])
+                if cal.unmark(today):
+                    persist_append("cc_med_doses", {"med_id": m["id"], "date": today.isoformat(), "taken": False, "ts": dt.datetime.now().isoformat()})
+                    supabase_upsert_state()
+            if colE.button(t("remove_med"), key=f"med_remove_{m['id']}"):
+                st.session_state.meds.remove(m)
+                sync_reminders()
+                supabase_upsert_state()
+                st.rerun(scope="fragment")
+            status = "✅ taken today" if cal.is_set(today) else "not yet today"
+            colA.caption(f"{status} • streak {cal.streak(today)} d • 30d {cal.rate(30, today):.0%} • 90d {cal.rate(90, today):.0%}")
 
-with tab_manage:
+def manage_ui():
     vitals_capture_ui()
+    vitals_chart_ui()
     st.divider()
     meds_ui()
 
@@ -949,12 +3186,16 @@ def n1_ui():
         colA, colB, colC = st.columns(3)
         start = colA.date_input(t("start"), value=dt.date.today())
         days = colB.number_input(t("days_per_phase"), min_value=3, max_value=14, value=int(n1.get("days",7)))
+        cycles = colC.number_input(t("cycles"), min_value=1, max_value=4, value=int(n1.get("cycles",2)),
+                                   help="Repeating A→B lets the analysis test the effect across crossovers.")
         n1["start"] = start.isoformat()
         n1["days"] = int(days)
-        seq = [("A" if (i//days)%2==0 else "B") for i in range(days*2)]
+        n1["cycles"] = int(cycles)
+        seq = [("A" if (i//days)%2==0 else "B") for i in range(days*2*cycles)]
         n1["sequence"] = seq
-        st.write("Sequence:", " → ".join(seq))
+        st.write("Sequence:", " → ".join(seq[::days]) + f" ({days} days each)")
         if st.button("Begin Experiment", key="n1_start"):
+            n1["id"] = str(uuid.uuid4())  # keys this run's rows in cc_n1_obs
             n1["obs"] = []
             n1["active"] = True
             st.success("Experiment started. Log today’s outcome below.")
@@ -964,17 +3205,20 @@ def n1_ui():
         colA, colB = st.columns([2,1])
         val = colA.number_input("Today's value", min_value=0.0, max_value=400.0, step=0.5, key="n1_value")
         if colB.button(t("add_obs"), key="n1_add_obs"):
-            st.session_state.n1.setdefault("obs", []).append({
+            ob = {
                 "date": dt.date.today().isoformat(),
                 "phase": current_phase(),
                 "value": float(val)
-            })
+            }
+            st.session_state.n1.setdefault("obs", []).append(ob)
+            persist_append("cc_n1_obs", {"exp_id": st.session_state.n1.get("id"), **ob, "ts": dt.datetime.now().isoformat()})
             add_xp(5)
             st.success("Observation added (+5 XP)")
-            if SUPABASE: supabase_upsert_state()
         st.dataframe(st.session_state.n1.get("obs", [])[::-1], use_container_width=True)
+        washout = st.number_input(t("washout"), min_value=0, max_value=max(0, int(n1.get("days", 7)) - 1), value=0,
+                                  key="n1_washout", help="Drop the first days of each phase to limit carry-over.")
         if st.button(t("end_exp"), key="n1_end"):
-            show_n1_results()
+            show_n1_results(int(washout))
 
 def current_phase():
     n1 = st.session_state.n1
@@ -986,71 +3230,151 @@ def current_phase():
     idx = min(days_since, len(n1["sequence"])-1)
     return n1["sequence"][idx]
 
-def show_n1_results():
+N1_PERMUTATIONS = 20000
+N1_BOOTSTRAPS = 10000
+
+def _n1_stats(obs: tuple, start: str, days: int, n_blocks: int, washout: int = 0,
+              n_perm: int = N1_PERMUTATIONS, n_boot: int = N1_BOOTSTRAPS, seed: int = 0) -> Dict[str, Any]:
+    # obs: ((iso_date, phase, value), ...). Days map to phase blocks of `days` days; the first `washout`
+    # days of each block are dropped. Phase labels are permuted at block level (days within a block are
+    # not exchangeable), Δ = mean(B) − mean(A) gets a stratified bootstrap CI, and each A→B cycle
+    # gives its own Δ estimate.
+    d0 = dt.date.fromisoformat(start)
+    rows = []
+    for date, phase, value in obs:
+        d = max(0, (dt.date.fromisoformat(date) - d0).days)
+        if d % days >= washout:
+            rows.append((min(d // days, n_blocks - 1), phase == "B", float(value)))
+    if not rows:
+        return {"ok": False, "reason": "No observations left after washout."}
+    block, is_b, y = (np.array(c) for c in zip(*rows))
+    if is_b.all() or not is_b.any():
+        return {"ok": False, "reason": "Need at least one value in each phase."}
+    rng = np.random.default_rng(seed)
+    a, b = y[~is_b], y[is_b]
+    delta = float(b.mean() - a.mean())
+    out = {"ok": True, "n_a": len(a), "n_b": len(b), "mean_a": float(a.mean()), "mean_b": float(b.mean()), "delta": delta}
+
+    # Bootstrap: resample days within each phase, all resamples at once
+    boot = b[rng.integers(0, len(b), (n_boot, len(b)))].mean(1) - a[rng.integers(0, len(a), (n_boot, len(a)))].mean(1)
+    out["ci"] = tuple(float(v) for v in np.percentile(boot, [2.5, 97.5]))
+
+    # Block permutation test: exact when the number of label assignments is small
+    blocks = np.unique(block)
+    pos = np.searchsorted(blocks, block)
+    sums, counts = np.bincount(pos, y), np.bincount(pos).astype(float)
+    labels = np.array([is_b[pos == i][0] for i in range(len(blocks))])
+    k, k_b = len(blocks), int(labels.sum())
+    if math.comb(k, k_b) <= n_perm:
+        assign = np.zeros((math.comb(k, k_b), k), dtype=bool)
+        for r, chosen in enumerate(itertools.combinations(range(k), k_b)):
+            assign[r, list(chosen)] = True
+    else:
+        assign = rng.permuted(np.tile(labels, (n_perm, 1)), axis=1)
+    lb = assign.astype(float)
+    perm = (lb @ sums) / (lb @ counts) - ((1 - lb) @ sums) / ((1 - lb) @ counts)
+    out["p"] = float((np.abs(perm) >= abs(delta) - 1e-12).mean())
+    out["n_assignments"] = len(assign)
+
+    # Repeated crossovers: blocks (2c, 2c+1) form cycle c
+    per_cycle = []
+    for c in range(n_blocks // 2):
+        ya, yb = y[(block == 2 * c) & ~is_b], y[(block == 2 * c + 1) & is_b]
+        if len(ya) and len(yb):
+            per_cycle.append(float(yb.mean() - ya.mean()))
+    out["cycles"] = per_cycle
+    if len(per_cycle) >= 2:
+        out["cycle_mean"] = float(np.mean(per_cycle))
+        out["cycle_se"] = float(np.std(per_cycle, ddof=1) / math.sqrt(len(per_cycle)))
+    return out
+
+# Cached by observation set + design, so reruns and repeated "Analyze" clicks are free
+n1_analyze = st.cache_data(max_entries=64, show_spinner=False)(_n1_stats)
+
+def show_n1_results(washout: int = 0):
     n1 = st.session_state.n1
     obs = n1.get("obs", [])
     if not obs:
         st.warning("No observations to analyze.")
         return
-    a_vals = [o["value"] for o in obs if o["phase"]=="A"]
-    b_vals = [o["value"] for o in obs if o["phase"]=="B"]
-    if not a_vals or not b_vals:
-        st.info("Need at least one value in each phase.")
+    days = int(n1.get("days", 7))
+    n_blocks = max(2, len(n1.get("sequence", [])) // days)
+    res = n1_analyze(tuple((o["date"], o["phase"], o["value"]) for o in obs), n1.get("start") or obs[0]["date"], days, n_blocks, washout)
+    if not res["ok"]:
+        st.info(res["reason"])
         return
-    import statistics as stats
-    mean_a = stats.mean(a_vals); mean_b = stats.mean(b_vals)
-    diff = mean_b - mean_a  # B minus A
-    st.success(f"Results — {n1['phaseA']} vs {n1['phaseB']}:  A={mean_a:.1f}, B={mean_b:.1f}, Δ={diff:+.1f}")
+    lo, hi = res["ci"]
+    st.success(f"Results — {n1['phaseA']} vs {n1['phaseB']}:  A={res['mean_a']:.1f}, B={res['mean_b']:.1f}, Δ={res['delta']:+.1f} "
+               f"(95% CI {lo:+.1f} to {hi:+.1f})")
+    if res["n_assignments"] > 2:
+        st.write(f"Block permutation test: p = {res['p']:.3f} ({res['n_assignments']:,} label assignments)")
+    else:
+        st.caption("Permutation test needs at least two A→B cycles to say anything; run more crossovers next time.")
+    if "cycle_mean" in res:
+        st.write(f"Across {len(res['cycles'])} crossovers: Δ = {res['cycle_mean']:+.1f} ± {res['cycle_se']:.1f} (SE) — "
+                 + ", ".join(f"{d:+.1f}" for d in res["cycles"]))
+    if washout:
+        st.caption(f"First {washout} day(s) of each phase excluded as washout.")
     st.caption("Rule of thumb: If Δ is clinically meaningful and consistent, prefer the better phase for you.")
     # Reset experiment
     st.session_state.n1["active"] = False
     if SUPABASE: supabase_upsert_state()
 
-with tab_exper:
-    n1_ui()
-
 # ---------------------------
 # Community Map & Micro-Events
 # ---------------------------
 def community_ui():
     st.subheader(t("micro"))
-    zipc = st.text_input(t("zip"), value=st.session_state.zip, key="comm_zip")
-    colA, colB, colC = st.columns([2,1,1])
+    cz, cr = st.columns([3,1])
+    zipc = cz.text_input(t("zip"), value=st.session_state.zip, key="comm_zip")
+    radius = cr.selectbox(t("radius"), sorted({1, 5, 10, 25, EVENT_RADIUS_MI}), index=sorted({1, 5, 10, 25, EVENT_RADIUS_MI}).index(EVENT_RADIUS_MI),
+                          format_func=lambda m: f"{m:g} mi", key="comm_radius")
+    geo = geocode_zip(zipc)
+    here = (geo["lat"], geo["lon"]) if geo and geo.get("lat") is not None else None
+    store = get_community_store()
+    colA, colB, colC, colD = st.columns([2,1,1,1])
     ev_name = colA.text_input(t("event_name"), key="ev_name")
-    ev_time = colB.text_input(t("event_time"), placeholder="Sat 9:00 AM", key="ev_time")
-    ev_loc  = colC.text_input(t("event_loc"), key="ev_loc")
+    next_hour = (dt.datetime.now() + dt.timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    ev_day  = colB.date_input(t("event_time"), value=next_hour.date(), min_value=dt.date.today(), key="ev_day")
+    ev_at   = colC.time_input(" ", value=next_hour.time(), key="ev_at")
+    ev_loc  = colD.text_input(t("event_loc"), key="ev_loc")
     ev_desc = st.text_area(t("event_desc"), key="ev_desc")
     if st.button(t("event_add"), key="ev_add"):
-        if ev_name and ev_time and ev_loc:
-            st.session_state.events.append({"name":ev_name,"time":ev_time,"loc":ev_loc,"desc":ev_desc})
+        when = dt.datetime.combine(ev_day, ev_at)
+        if when <= dt.datetime.now():
+            st.warning("Pick a time later than now.")
+        elif ev_name and ev_loc:
+            ev = {"id": str(uuid.uuid4()), "name": ev_name, "time": when.strftime("%a %b %d, %I:%M %p"), "when": when.isoformat(),
+                  "loc": ev_loc, "desc": ev_desc}
+            if here:  # placed at the ZIP's centroid and shared with everyone nearby
+                ev.update(lat=here[0], lon=here[1])
+                store.add("event", ev)
+                persist_append("cc_events", {k: ev[k] for k in ("id", "name", "when", "loc", "desc", "lat", "lon")})
+            st.session_state.events.append(ev)
             add_xp(10)
             if SUPABASE: supabase_upsert_state()
             st.success("Event added (+10 XP)")
         else:
             st.warning("Name, time, and location required.")
 
-    # Nearby demo events
-    demo = COMMUNITY_DEMO.get(zipc, [])
-    events = demo + st.session_state.events
-    if MAPBOX_TOKEN:
-        geo = geocode_zip(zipc) if OPENWEATHER_API_KEY else None
-        if geo and geo.get("lat"):
-            url = mapbox_static(geo["lat"], geo["lon"])
-            if url:
-                st.image(url, caption=f"Community near {zipc}")
+    # Upcoming events within the radius (shared store), plus this user's events that couldn't be placed
+    events = store.events_near(here[0], here[1], radius) if here else []
+    events += [e for e in st.session_state.events if "lat" not in e]
+    if MAPBOX_TOKEN and here:
+        img = mapbox_static(*here)
+        if img:
+            st.image(img, caption=f"Community near {zipc}")
     st.markdown("### Upcoming Micro-Events")
     if not events:
         st.info("No events yet. Add one above!")
     for i, e in enumerate(events):
         with st.container(border=True):
             c1, c2 = st.columns([3,1])
-            c1.write(f"**{e['name']}**  \n{e['time']} @ {e['loc']}  \n{e['desc'] or ''}")
-            if c2.button(t("rsvp"), key=f"rsvp_{i}"):
+            dist = f" • {e['miles']:.1f} mi" if "miles" in e else ""
+            c1.write(f"**{e['name']}**  \n{e['time']} @ {e['loc']}{dist}  \n{e['desc'] or ''}")
+            if c2.button(t("rsvp"), key=f"rsvp_{e.get('id', i)}"):
                 add_xp(4); st.success("RSVP recorded (+4 XP)")
 
-with tab_comm:
-    community_ui()
-
 # ---------------------------
 # Trusted Resource Concierge
 # ---------------------------
@@ -1080,9 +3404,6 @@ def concierge_ui():
         st.link_button(name, href, use_container_width=True)
     st.caption(t("not_med"))
 
-with tab_resources:
-    concierge_ui()
-
 # ---------------------------
 # Pro — Monetization lanes that add value
 # ---------------------------
@@ -1101,40 +3422,66 @@ def pro_ui():
         else:
             st.info("Set CHECKOUT_URL env var to enable upgrade link.")
 
-with tab_pro:
-    pro_ui()
-
 # ---------------------------
 # Share tab (unchanged)
 # ---------------------------
-with tab_share:
+def share_ui():
     st.subheader(t("share_hdr"))
     st.caption(t("share_cap"))
-    inc_steps = st.checkbox(t("inc_act"), value=True, key="share_steps")
-    inc_lessons = st.checkbox(t("inc_edu"), value=True, key="share_lessons")
-    inc_meals = st.checkbox(t("inc_diet"), value=False, key="share_meals")
-    q = {"care":"1","s":"1" if inc_steps else "0","l":"1" if inc_lessons else "0","m":"1" if inc_meals else "0"}
+    prefs = st.session_state.share_prefs
+    inc_steps = st.checkbox(t("inc_act"), value=prefs["steps"], key="share_steps")
+    inc_lessons = st.checkbox(t("inc_edu"), value=prefs["lessons"], key="share_lessons")
+    inc_meals = st.checkbox(t("inc_diet"), value=prefs["meals"], key="share_meals")
+    q = {"care":"1","u":get_user_id(),"s":"1" if inc_steps else "0","l":"1" if inc_lessons else "0","m":"1" if inc_meals else "0"}
     share_suffix = "?" + urllib.parse.urlencode(q)
     st.code(share_suffix, language="text")
     st.caption("Append this to your deployed app URL to share a read-only view.")
-    if SUPABASE and st.button("Save Share Prefs", key="save_share_prefs"):
-        SUPABASE.table("cc_shares").upsert({
-            "user_id": get_user_id(),
-            "include_steps": inc_steps,
-            "include_lessons": inc_lessons,
-            "include_meals": inc_meals,
-        }).execute()
+    if {"steps": inc_steps, "lessons": inc_lessons, "meals": inc_meals} != prefs:
+        st.caption("The shared summary only includes what you save below.")
+    if st.button("Save Share Prefs", key="save_share_prefs"):
+        st.session_state.share_prefs = {"steps": inc_steps, "lessons": inc_lessons, "meals": inc_meals}
+        if SUPABASE:
+            sb_execute(SUPABASE.table("cc_shares").upsert({
+                "user_id": get_user_id(),
+                "include_steps": inc_steps,
+                "include_lessons": inc_lessons,
+                "include_meals": inc_meals,
+            }))
         st.success("Share preferences saved.")
 
+# ---------------------------
+# Navigation
+# ---------------------------
+# "lazy" (default): a section switcher, and only the selected section's code runs on a rerun, so e.g.
+# "+500 steps" never triggers weather lookups. "tabs": classic st.tabs, every section runs every rerun.
+NAV_MODE = (secret_or_env("NAV_MODE") or "lazy").lower()
+SECTIONS = [
+    ("diet", diet_ui), ("edu", edu_ui), ("ex", exercise_ui), ("manage", manage_ui), ("experiments", n1_ui),
+    ("community", community_ui), ("res", concierge_ui), ("pro", pro_ui), ("share", share_ui),
+]
+
+if NAV_MODE == "tabs":
+    for tab, (_, render) in zip(st.tabs([t(k) for k, _ in SECTIONS]), SECTIONS):
+        with tab:
+            render()
+else:
+    section = st.radio("Section", [k for k, _ in SECTIONS], format_func=t, horizontal=True,
+                       key="section", label_visibility="collapsed")
+    dict(SECTIONS)[section]()
+
 st.divider()
 colL, colR = st.columns([2,2])
 with colL:
+    snap = care_snapshot()
     st.write(t("summary"))
-    st.write(t("avg_steps"))
-    st.write(t("lessons_done"))
-    st.write(t("meals_logged"))
+    st.write(t("avg_steps").format(snap["steps_avg_7d"]))
+    st.write(t("lessons_done").format(snap["lessons_7d"]))
+    st.write(t("meals_logged").format(snap["meals_7d"]))
 with colR:
     st.write(t("privacy"))
     if st.button(t("claim"), key="claim_weekly"):
         add_xp(50)
         st.success("Weekly challenge claimed! +50 XP")
+
+# Hand this rerun's changes to the write-behind worker (st.rerun() keeps the dirty flag for the next run)
+supabase_flush_state()
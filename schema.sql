@@ -0,0 +1,102 @@
+-- Supabase (Postgres) schema for CareCompanion's optional persistence.
+-- Safe to re-run: on a database created for an older version it only adds what's missing.
+-- JSON-valued cc_state columns hold json.dumps() text, so they are `text`, not `jsonb`.
+
+create table if not exists cc_users (
+    user_id text primary key,
+    name    text
+);
+
+create table if not exists cc_state (
+    user_id text primary key
+);
+alter table cc_state
+    add column if not exists xp               integer default 0,
+    add column if not exists quiz_streak      integer default 0,
+    add column if not exists boss_unlocked    boolean default false,
+    add column if not exists boss_cleared     boolean default false,
+    add column if not exists sodium_budget_mg integer default 1500,
+    add column if not exists sugar_budget_g   integer default 25,
+    add column if not exists steps            integer default 0,   -- today's count; history is step_log
+    add column if not exists goal             integer default 8000,
+    add column if not exists zip              text,
+    add column if not exists culture          text default 'global',
+    add column if not exists tz               text,
+    add column if not exists conditions       text,
+    add column if not exists flags            text,
+    add column if not exists meals_today      text,
+    add column if not exists vitals           text,   -- legacy readings; delta mode appends to cc_vitals
+    add column if not exists meds             text,
+    add column if not exists events           text,
+    add column if not exists n1               text,
+    add column if not exists nutrition        text,
+    add column if not exists week_log         text,
+    add column if not exists step_log         text;
+
+create table if not exists cc_shares (
+    user_id         text primary key,
+    include_steps   boolean not null default true,
+    include_lessons boolean not null default true,
+    include_meals   boolean not null default false
+);
+
+-- Append-only child tables written in PERSIST_MODE=delta
+create table if not exists cc_vitals (
+    id      bigint generated always as identity primary key,
+    user_id text not null,
+    ts      timestamp not null,
+    bp_sys  real,
+    bp_dia  real,
+    glucose real,
+    weight  real
+);
+create index if not exists cc_vitals_user_ts on cc_vitals (user_id, ts);
+
+create table if not exists cc_med_doses (
+    id      bigint generated always as identity primary key,
+    user_id text not null,
+    med_id  text not null,
+    date    date not null,
+    taken   boolean not null,
+    ts      timestamp not null
+);
+create index if not exists cc_med_doses_user_med on cc_med_doses (user_id, med_id, ts);
+
+create table if not exists cc_n1_obs (
+    id      bigint generated always as identity primary key,
+    user_id text not null,
+    exp_id  text not null,
+    date    date not null,
+    phase   text not null,
+    value   double precision not null,
+    ts      timestamp not null
+);
+create index if not exists cc_n1_obs_user_exp on cc_n1_obs (user_id, exp_id, ts);
+
+-- Caregiver view: one precomputed, share-filtered summary per patient
+create table if not exists cc_care_snapshots (
+    user_id    text primary key,
+    snapshot   text not null,
+    updated_at timestamptz not null default now()
+);
+
+-- Community events shared across sessions and replicas
+create table if not exists cc_events (
+    id      text primary key,
+    user_id text,
+    name    text not null,
+    "when"  timestamp not null,
+    loc     text,
+    "desc"  text,
+    lat     double precision,
+    lon     double precision
+);
+create index if not exists cc_events_when on cc_events ("when");
+
+-- One row per dose reminder sent; the unique key lets exactly one replica claim it
+create table if not exists cc_reminders_sent (
+    user_id text not null,
+    med_id  text not null,
+    due     timestamptz not null,
+    primary key (user_id, med_id, due)
+);